@@ -1,11 +1,11 @@
 import streamlit as st
-from document_processor import DocumentProcessor
-from vector_db import VectorDatabase
-from quiz_generator import QuizGenerator
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from config import CONFIG
+from metrics import metrics
+from lazy import lazy_import
 import os
 import time
+import hashlib
+import threading
 
 # Configuración Streamlit
 st.set_page_config(
@@ -16,66 +16,144 @@ st.set_page_config(
 
 st.title("📝 Generador Automático de Cuestionarios")
 
-def generar_pdf(quiz, filename="cuestionario.pdf"):
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
-    from reportlab.pdfbase.pdfmetrics import stringWidth
-
-    c = canvas.Canvas(filename, pagesize=letter)
-    width, height = letter
-    y = height - 50
-
-    max_width = width - 100  # margen derecho e izquierdo
-
-    def draw_wrapped_text(c, text, x, y, font_name, font_size, max_width, line_height):
-        c.setFont(font_name, font_size)
-        words = text.split()
-        line = ""
-        for word in words:
-            test_line = f"{line} {word}".strip()
-            if stringWidth(test_line, font_name, font_size) <= max_width:
-                line = test_line
-            else:
-                c.drawString(x, y, line)
-                y -= line_height
-                line = word
-        if line:
-            c.drawString(x, y, line)
-            y -= line_height
-        return y
-
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, y, "Cuestionario generado automáticamente")
-    y -= 40
-
-    for i, pregunta in enumerate(quiz["cuestionario"], 1):
-        c.setFont("Helvetica-Bold", 12)
-        y = draw_wrapped_text(c, f"{i}. {pregunta.get('enunciado', '')}", 50, y, "Helvetica-Bold", 12, max_width, 15)
+@st.cache_resource(show_spinner=False)
+def calentar_modelos():
+    """Precarga los modelos de Ollama una sola vez por proceso"""
+    def precargar():
+        # Los módulos pesados se importan en segundo plano: la página aparece antes
+        lazy_import("clients").warm_up()
+        lazy_import("ingest")
+        lazy_import("quiz_generator")
 
+    threading.Thread(target=precargar, daemon=True).start()
+    return True
+
+calentar_modelos()
+
+def mostrar_pregunta(i, pregunta):
+    with st.expander(f"Pregunta {i} - {pregunta.get('tipo', '')}"):
+        st.markdown(f"**{pregunta.get('enunciado', '')}**")
         if pregunta.get("tipo") == "opcion_multiple":
-            c.setFont("Helvetica", 11)
+            st.markdown("**Opciones:**")
             for j, opcion in enumerate(pregunta.get("opciones", [])):
-                y = draw_wrapped_text(c, f"{chr(65+j)}. {opcion}", 70, y, "Helvetica", 11, max_width, 13)
-
-        c.setFont("Helvetica-Oblique", 11)
+                st.markdown(f"{chr(65+j)}. {opcion}")
         if pregunta.get("tipo") == "pregunta_abierta":
-            y = draw_wrapped_text(c, "Respuesta: [Respuesta abierta]", 70, y, "Helvetica-Oblique", 11, max_width, 13)
+            st.markdown("**Respuesta:** [Respuesta abierta]")
         else:
-            y = draw_wrapped_text(c, f"Respuesta: {pregunta.get('respuesta_correcta', '')}", 70, y, "Helvetica-Oblique", 11, max_width, 13)
-
-        explicacion = pregunta.get("explicacion", "")
-        if explicacion:
-            c.setFont("Helvetica", 10)
-            y = draw_wrapped_text(c, f"Explicación: {explicacion}", 70, y, "Helvetica", 10, max_width, 12)
-            y -= 10
+            st.markdown(f"**Respuesta:** {pregunta.get('respuesta_correcta', '')}")
+        st.markdown(f"**Explicación:** {pregunta.get('explicacion', '')}")
+
+@st.cache_resource(max_entries=CONFIG["APP_INDICES_MAX"],
+                   show_spinner="Procesando documentos y creando base de conocimiento...")
+def obtener_indice(doc_hashes, _archivos):
+    """Índice compartido por todas las sesiones y reruns.
+
+    La clave es el hash del contenido de los PDF (``_archivos`` no participa
+    en la clave), así que mover un control o subir el mismo PDF desde otra
+    sesión reutiliza el índice abierto sin volver a parsear nada.
+    """
+    # Cada subida se registra por su contenido y su nombre, no por el nombre
+    # solo: dos usuarios que suben "tema1.pdf" distintos no comparten origen,
+    # así que ninguna subida purga la colección (ni el banco) de otra que
+    # puede seguir abierta en la caché de otra sesión
+    origenes = {}
+    for doc_hash, (nombre, datos) in zip(doc_hashes, _archivos):
+        carpeta = os.path.join(CONFIG["CACHE_DIR"], "subidas", doc_hash[:16])
+        os.makedirs(carpeta, exist_ok=True)
+        path = os.path.join(carpeta, os.path.basename(nombre))
+        with open(path, "wb") as f:
+            f.write(datos)
+        origenes[path] = f"subida/{doc_hash[:16]}/{os.path.basename(nombre)}"
+    paths = list(origenes)
+
+    try:
+        vector_db = lazy_import("ingest").ingest_files(paths, sources=origenes)
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Una excepción no queda cacheada: el siguiente rerun lo reintenta
+    if not vector_db:
+        raise RuntimeError("No se pudo indexar ningún documento")
+    return vector_db
+
+def hash_subida(uploaded_file):
+    """Hash del contenido de un archivo subido, calculado una vez por sesión"""
+    hashes = st.session_state.setdefault("hashes_subidas", {})
+    if uploaded_file.file_id not in hashes:
+        hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return hashes[uploaded_file.file_id]
+
+def lanzar_generacion(cola, vector_db, doc_hashes, tema, num_preguntas, percentages, nuevo):
+    """Encola la generación; las peticiones idénticas en curso comparten el mismo trabajo"""
+    def tarea():
+        QuizGenerator = lazy_import("quiz_generator").QuizGenerator
+        generator = QuizGenerator(vector_db.as_retriever(), cache=lazy_import("clients").get_quiz_cache())
+        return generator.stream_quiz(
+            topic=tema, num_questions=num_preguntas, percentages=percentages, fresh=nuevo
+        )
+
+    return cola.submit((doc_hashes, tema, num_preguntas, percentages, nuevo), tarea)
+
+def mostrar_trabajo(cola, trabajo):
+    """Muestra el progreso de un trabajo y vuelve a consultarlo hasta que termina.
+
+    El hilo de la sesión no espera a la generación: cada consulta es un
+    rerun breve que pinta las preguntas recibidas hasta el momento.
+    """
+    estado = cola.status(trabajo)
+    if estado is None:
+        st.session_state.pop("trabajo", None)
+        return
+
+    # Las preguntas se muestran una a una según las va generando el modelo
+    preguntas = [valor for evento, valor in cola.events(trabajo) if evento == "pregunta"]
+    for i, pregunta in enumerate(preguntas, 1):
+        mostrar_pregunta(i, pregunta)
+
+    if estado["estado"] in ("pendiente", "en_curso"):
+        if estado["estado"] == "pendiente":
+            st.info(f"⏳ En cola: {estado['posicion']} cuestionarios por delante")
         else:
-            y -= 10
-
-        if y < 100:
-            c.showPage()
-            y = height - 50
-
-    c.save()
+            st.info(f"⚙️ Generando cuestionario... ({len(preguntas)} preguntas listas)")
+        if st.button("⏹️ Cancelar"):
+            cola.cancel(trabajo)
+            st.session_state.pop("trabajo", None)
+            st.rerun()
+        time.sleep(CONFIG["APP_SONDEO"])
+        st.rerun()
+
+    if estado["estado"] == "cancelado":
+        st.warning("Generación cancelada")
+        return
+    if estado["estado"] == "error":
+        st.error(f"⚠️ Error en la generación: {estado.get('error', '')}")
+        return
+
+    quiz = estado.get("resultado")
+    if quiz and "error" in quiz:
+        st.error(f"⚠️ Error en la generación: {quiz['error']}")
+
+    if quiz and "cuestionario" in quiz:
+        st.divider()
+        st.success("✅ Cuestionario generado con éxito!")
+
+        # PDF en memoria: cada sesión descarga el suyo sin tocar el disco
+        export_pdf = lazy_import("pdf_export").export_pdf
+        col_profesor, col_alumno = st.columns(2)
+        col_profesor.download_button(
+            label="📥 Descargar cuestionario (PDF)",
+            data=export_pdf(quiz, "profesor"),
+            file_name="cuestionario.pdf",
+            mime="application/pdf"
+        )
+        col_alumno.download_button(
+            label="📥 Versión para el alumno (sin respuestas)",
+            data=export_pdf(quiz, "alumno"),
+            file_name="cuestionario_alumno.pdf",
+            mime="application/pdf"
+        )
 
 def main():
     st.sidebar.header("⚙️ Configuración")
@@ -88,80 +166,53 @@ def main():
     tema_estudio = st.sidebar.text_input("Tema de estudio (opcional)", 
                                          placeholder="Ej: Historia del Renacimiento",
                                          help="Especifica el tema principal para enfocar el cuestionario")
+    nuevo = st.sidebar.checkbox("Generar una versión nueva",
+                                help="Ignora los cuestionarios guardados y genera uno distinto")
 
-    uploaded_file = st.file_uploader("Sube tu documento académico (PDF)", type="pdf")
+    with st.sidebar.expander("📈 Métricas del proceso"):
+        st.code(metrics.exportar_prometheus(), language="text")
 
-    if uploaded_file:
-        temp_path = f"temp_{uploaded_file.name}"
-        with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getvalue())
+    uploaded_files = st.file_uploader(
+        "Sube tus documentos académicos (PDF)", type="pdf", accept_multiple_files=True
+    )
 
+    if uploaded_files:
+        vector_db = None
         try:
-            with st.spinner("Procesando documento..."):
-                processor = DocumentProcessor()
-                chunks = processor.load_and_split(temp_path)
-
-            if chunks:
-                st.success("✅ Documento procesado correctamente. Base de conocimiento lista.")
-
-                # Crear la base de conocimiento y guardarla en sesión para usar después
-                if "vector_db" not in st.session_state:
-                    with st.spinner("Creando base de conocimiento..."):
-                        db = VectorDatabase()
-                        st.session_state.vector_db = db.create_db(chunks, "quiz_temp")
+            subidas = sorted(((hash_subida(f), f) for f in uploaded_files), key=lambda s: s[0])
+            vector_db = obtener_indice(
+                tuple(doc_hash for doc_hash, _ in subidas),
+                [(f.name, f.getvalue()) for _, f in subidas]
+            )
+            st.success("✅ Documentos procesados correctamente. Base de conocimiento lista.")
 
         except Exception as e:
             st.error(f"❌ Error al procesar: {str(e)}")
 
         # Si la base de conocimiento ya está creada:
-        if "vector_db" in st.session_state:
+        if vector_db:
+            cola = lazy_import("clients").get_job_queue()
             if st.button("🎛️ Generar cuestionario"):
-                with st.spinner("Generando cuestionario..."):
-                    generator = QuizGenerator(st.session_state.vector_db.as_retriever())
-
-                    if tipo_preguntas == "Opción múltiple":
-                        percentages = (100, 0, 0)
-                    elif tipo_preguntas == "Verdadero/Falso":
-                        percentages = (0, 100, 0)
-                    elif tipo_preguntas == "Pregunta abierta":
-                        percentages = (0, 0, 100)
-                    else:
-                        percentages = (33, 33, 33)
-
-                    quiz = generator.generate_quiz(
-                        topic=tema_estudio if tema_estudio else "contenido del documento",
-                        num_questions=num_preguntas,
-                        percentages=percentages
-                    )
-
-                    if quiz and "cuestionario" in quiz:
-                        st.success("✅ Cuestionario generado con éxito!")
-                        st.divider()
-
-                        for i, pregunta in enumerate(quiz["cuestionario"], 1):
-                            with st.expander(f"Pregunta {i} - {pregunta.get('tipo', '')}"):
-                                st.markdown(f"**{pregunta.get('enunciado', '')}**")
-                                if pregunta.get("tipo") == "opcion_multiple":
-                                    st.markdown("**Opciones:**")
-                                    for j, opcion in enumerate(pregunta.get("opciones", [])):
-                                        st.markdown(f"{chr(65+j)}. {opcion}")
-                                if pregunta.get("tipo") == "pregunta_abierta":
-                                    st.markdown("**Respuesta:** [Respuesta abierta]")
-                                else:
-                                    st.markdown(f"**Respuesta:** {pregunta.get('respuesta_correcta', '')}")
-                                st.markdown(f"**Explicación:** {pregunta.get('explicacion', '')}")
-
-                        generar_pdf(quiz)
-                        with open("cuestionario.pdf", "rb") as pdf_file:
-                            st.download_button(
-                                label="📥 Descargar cuestionario (PDF)",
-                                data=pdf_file,
-                                file_name="cuestionario.pdf",
-                                mime="application/pdf"
-                            )
-        # Limpieza
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+                if tipo_preguntas == "Opción múltiple":
+                    percentages = (100, 0, 0)
+                elif tipo_preguntas == "Verdadero/Falso":
+                    percentages = (0, 100, 0)
+                elif tipo_preguntas == "Pregunta abierta":
+                    percentages = (0, 0, 100)
+                else:
+                    percentages = (33, 33, 33)
+
+                anterior = st.session_state.get("trabajo")
+                if anterior:
+                    cola.cancel(anterior)
+                st.session_state["trabajo"] = lanzar_generacion(
+                    cola, vector_db, tuple(doc_hash for doc_hash, _ in subidas),
+                    tema_estudio if tema_estudio else "contenido del documento",
+                    num_preguntas, percentages, nuevo
+                )
+
+            if st.session_state.get("trabajo"):
+                mostrar_trabajo(cola, st.session_state["trabajo"])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,288 @@
+"""Generación de cuestionarios por lotes, sin interacción y reanudable.
+
+Lee un manifiesto con las tareas (archivos × temas), indexa los documentos
+en un pool de procesos y genera los cuestionarios en un pool de hilos en
+cuanto sus documentos están listos. Cada resultado se añade al JSONL de
+salida nada más terminar; ese mismo archivo es el punto de control: al
+relanzar el lote se omiten las tareas que ya tienen un resultado correcto.
+
+    python batch.py manifiesto.json --salida resultados.jsonl --workers 4
+
+Formato del manifiesto (JSON, o JSONL con una tarea por línea):
+
+    {
+      "defecto": {"num_preguntas": 10, "porcentajes": [50, 30, 20]},
+      "tareas": [
+        {"archivos": ["cursos/biologia.pdf"], "temas": ["la célula", "fotosíntesis"]},
+        {"archivos": ["cursos/historia/"], "tema": "Revolución francesa", "num_preguntas": 5}
+      ]
+    }
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import CONFIG
+from lazy import lazy_import
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TEMA_POR_DEFECTO = "contenido educativo del documento"
+
+
+def load_manifest(path):
+    """Expande el manifiesto a una lista de tareas (una por archivo(s) y tema)"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            defecto = {}
+            entradas = [json.loads(linea) for linea in f if linea.strip()]
+        else:
+            data = json.load(f)
+            if isinstance(data, list):
+                data = {"tareas": data}
+            defecto = data.get("defecto", {})
+            entradas = data.get("tareas", [])
+
+    tareas, vistas = [], set()
+    for entrada in entradas:
+        entrada = {**defecto, **entrada}
+        entradas_archivos = [a for a in (entrada.get("archivos") or [entrada.get("archivo")]) if a]
+        archivos = lazy_import("document_processor").DocumentProcessor.expand_paths(entradas_archivos)
+        if not archivos:
+            logger.error(f"Tarea sin documentos, se omite: {entrada}")
+            continue
+
+        temas = entrada.get("temas") or [entrada.get("tema") or TEMA_POR_DEFECTO]
+        for tema in temas:
+            tarea = {
+                "archivos": archivos,
+                # Rutas tal como se dieron: nombran el corpus por defecto
+                "origenes": [os.path.abspath(a) for a in entradas_archivos],
+                "tema": tema,
+                "num_preguntas": int(entrada.get("num_preguntas", 5)),
+                "porcentajes": list(entrada.get("porcentajes", (50, 30, 20))),
+                "coleccion": entrada.get("coleccion")
+            }
+            tarea["id"] = lazy_import("cache").hash_texto(
+                *(os.path.abspath(a) for a in archivos), tarea["tema"],
+                tarea["num_preguntas"], tuple(tarea["porcentajes"]), tarea["coleccion"]
+            )[:16]
+            if tarea["id"] not in vistas:
+                vistas.add(tarea["id"])
+                tareas.append(tarea)
+    return tareas
+
+
+def _trim_partial_line(path):
+    """Elimina la última línea si quedó a medias (caída durante la escritura)"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        contenido = f.read()
+        if contenido and not contenido.endswith(b"\n"):
+            f.truncate(contenido.rfind(b"\n") + 1)
+            logger.warning(f"Línea incompleta eliminada del final de {path}")
+
+
+def completed_ids(path):
+    """Ids de las tareas con resultado correcto en un JSONL anterior"""
+    hechas = set()
+    if not os.path.exists(path):
+        return hechas
+    with open(path, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                continue
+            if registro.get("estado") == "ok":
+                hechas.add(registro["id"])
+    return hechas
+
+
+class BatchRunner:
+    """Ejecuta las tareas de un manifiesto escribiendo los resultados en JSONL"""
+
+    def __init__(self, salida, workers=None, ingesta_workers=None, fresh=False):
+        self.salida = salida
+        self.workers = workers or CONFIG["LOTE_WORKERS"]
+        self.ingesta_workers = ingesta_workers
+        self.fresh = fresh
+        # Chroma y LangChain se cargan al crear el ejecutor, no al importar el módulo
+        self.db = lazy_import("vector_db").VectorDatabase()
+        self.cache = lazy_import("clients").get_quiz_cache()
+        self._lock = threading.Lock()
+        self.resumen = {"ok": 0, "error": 0, "omitidas": 0, "preguntas": 0}
+
+    def _write(self, registro):
+        """Añade un resultado al JSONL y lo fuerza a disco (punto de control)"""
+        linea = json.dumps(registro, ensure_ascii=False)
+        with self._lock:
+            with open(self.salida, "a", encoding="utf-8") as f:
+                f.write(linea + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.resumen[registro["estado"]] += 1
+            self.resumen["preguntas"] += len(registro.get("cuestionario", []))
+
+    def _generate(self, tarea):
+        inicio = time.perf_counter()
+        registro = {k: tarea[k] for k in ("id", "archivos", "tema", "num_preguntas", "porcentajes")}
+        try:
+            vector_db = self.db.load_collection(tarea["coleccion"])
+            if vector_db is None:
+                raise RuntimeError("No se pudo indexar ningún documento de la tarea")
+
+            QuizGenerator = lazy_import("quiz_generator").QuizGenerator
+            generator = QuizGenerator(vector_db.as_retriever(search_kwargs={"k": 5}), cache=self.cache)
+            quiz = generator.generate_quiz(
+                topic=tarea["tema"],
+                num_questions=tarea["num_preguntas"],
+                percentages=tuple(tarea["porcentajes"]),
+                fresh=self.fresh
+            )
+            if quiz is None or "error" in quiz:
+                raise RuntimeError((quiz or {}).get("error", "respuesta vacía"))
+
+            registro.update(estado="ok", cuestionario=quiz["cuestionario"], metadata=quiz.get("metadata", {}))
+        except Exception as e:
+            logger.error(f"Tarea {tarea['id']} ({tarea['tema']}) fallida: {str(e)}")
+            registro.update(estado="error", error=str(e))
+
+        registro["segundos"] = round(time.perf_counter() - inicio, 3)
+        metrics.contar("lote_tareas_total", estado=registro["estado"])
+        self._write(registro)
+
+    def run(self, tareas):
+        """Indexa y genera las tareas pendientes; devuelve el resumen de rendimiento"""
+        _trim_partial_line(self.salida)
+        hechas = completed_ids(self.salida)
+        pendientes = [t for t in tareas if t["id"] not in hechas]
+        self.resumen["omitidas"] = len(tareas) - len(pendientes)
+        logger.info(f"Lote: {len(pendientes)} tareas pendientes, {self.resumen['omitidas']} ya completadas")
+
+        inicio = time.perf_counter()
+        hashes = {}
+        for tarea in pendientes:
+            for path in tarea["archivos"]:
+                if path not in hashes:
+                    hashes[path] = self.db.file_hash(path)
+            if tarea["coleccion"] is None:
+                tarea["coleccion"] = lazy_import("ingest").default_collection(
+                    [hashes[p] for p in tarea["archivos"]], tarea["origenes"]
+                )
+
+        # Documentos por indexar en cada colección y tareas que esperan por ellos
+        por_indexar = {}
+        esperando = {}
+        for tarea in pendientes:
+            faltan = {
+                path for path in tarea["archivos"]
+                if not self.db.is_indexed(hashes[path], tarea["coleccion"])
+            }
+            for path in faltan:
+                por_indexar.setdefault(path, set()).add(tarea["coleccion"])
+            esperando[tarea["id"]] = (tarea, faltan)
+
+        # Colecciones con documentos nuevos cuyo índice BM25 aún no se actualizó
+        sin_sincronizar = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def liberar(path=None):
+                """Lanza las tareas cuyos documentos ya están todos indexados"""
+                for tarea_id, (tarea, faltan) in list(esperando.items()):
+                    faltan.discard(path)
+                    if not faltan:
+                        del esperando[tarea_id]
+                        # Una vez por colección completa, no por documento
+                        if tarea["coleccion"] in sin_sincronizar:
+                            sin_sincronizar.discard(tarea["coleccion"])
+                            self.db.sync_lexical_index(tarea["coleccion"])
+                        pool.submit(self._generate, tarea)
+
+            # Las tareas ya listas se lanzan de inmediato: el pool de ingesta usa
+            # spawn, así que no importa que haya hilos de generación activos
+            liberar()
+            if por_indexar:
+                logger.info(f"Lote: indexando {len(por_indexar)} documentos")
+                for path, chunks in lazy_import("document_processor").DocumentProcessor.load_many(
+                    list(por_indexar), self.ingesta_workers
+                ):
+                    if not chunks:
+                        logger.error(f"Se omite {path}: no se pudo procesar")
+                    else:
+                        for coleccion in por_indexar[path]:
+                            self.db.index_document(
+                                chunks, hashes[path], os.path.abspath(path), coleccion, sync_lexical=False
+                            )
+                            sin_sincronizar.add(coleccion)
+                    liberar(path)
+
+        duracion = time.perf_counter() - inicio
+        procesadas = self.resumen["ok"] + self.resumen["error"]
+        self.resumen.update({
+            "segundos": round(duracion, 2),
+            "tareas_por_minuto": round(60 * procesadas / duracion, 2) if duracion else 0.0,
+            "preguntas_por_minuto": round(60 * self.resumen["preguntas"] / duracion, 2) if duracion else 0.0
+        })
+        return self.resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generación de cuestionarios por lotes")
+    parser.add_argument("manifiesto", help="Manifiesto JSON/JSONL con las tareas")
+    parser.add_argument("-s", "--salida", default="resultados.jsonl", help="JSONL de resultados (y punto de control)")
+    parser.add_argument("-w", "--workers", type=int, help="Cuestionarios generados en paralelo")
+    parser.add_argument("--ingesta-workers", type=int, help="Procesos para parsear los PDF")
+    parser.add_argument("--nuevo", action="store_true", help="Ignorar la caché de cuestionarios")
+    parser.add_argument("--metricas", help="Guardar las métricas (formato Prometheus) en este archivo")
+    parser.add_argument("--pdf", help="Exportar todos los cuestionarios correctos a este PDF")
+    parser.add_argument("--variantes", nargs="+", default=["alumno", "profesor"],
+                        help="Variantes de cada cuestionario en el PDF (alumno, profesor)")
+    args = parser.parse_args()
+
+    # reportlab sólo se carga si hay que exportar; se valida antes de generar nada
+    if args.pdf:
+        desconocidas = set(args.variantes) - set(lazy_import("pdf_export").VARIANTES)
+        if desconocidas:
+            parser.error(f"variantes desconocidas: {', '.join(sorted(desconocidas))}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    tareas = load_manifest(args.manifiesto)
+    if not tareas:
+        print("❌ El manifiesto no contiene tareas válidas")
+        raise SystemExit(1)
+
+    threading.Thread(target=lazy_import("clients").warm_up, daemon=True).start()
+    runner = BatchRunner(args.salida, args.workers, args.ingesta_workers, args.nuevo)
+    resumen = runner.run(tareas)
+
+    if args.metricas:
+        with open(args.metricas, "w", encoding="utf-8") as f:
+            f.write(metrics.exportar_prometheus())
+
+    print("\n📦 LOTE TERMINADO")
+    print(f"✅ Correctas: {resumen['ok']} | ❌ Fallidas: {resumen['error']} | ⏭️ Ya completadas: {resumen['omitidas']}")
+    print(f"⏱️ {resumen['segundos']} s | {resumen['tareas_por_minuto']} cuestionarios/min | "
+          f"{resumen['preguntas_por_minuto']} preguntas/min")
+    print(f"💾 Resultados en '{args.salida}'")
+
+    if args.pdf:
+        with open(args.salida, encoding="utf-8") as f:
+            registros = [json.loads(linea) for linea in f if linea.strip()]
+        registros = [r for r in registros if r.get("estado") == "ok"]
+        with open(args.pdf, "wb") as f:
+            export_many = lazy_import("pdf_export").export_many
+            f.write(export_many(registros, args.variantes, [f"Cuestionario: {r['tema']}" for r in registros]))
+        print(f"📄 {len(registros)} cuestionarios exportados a '{args.pdf}'")
+    if resumen["error"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""Benchmark de ingesta, recuperación y generación contra un Ollama simulado.
+
+Levanta un servidor HTTP local que imita la API de Ollama (embeddings
+deterministas y cuestionarios enlatados con latencia configurable), genera
+PDFs sintéticos y mide cada etapa: rendimiento, latencias p50/p95 y pico de
+memoria. Los resultados se guardan en JSON para compararlos entre versiones.
+
+    python benchmark.py --paginas 10 50 --salida bench.json
+    python benchmark.py --paginas 10 50 --comparar bench.json
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+DIMENSION_EMBEDDINGS = 384
+
+
+def embedding_determinista(texto):
+    """Vector normalizado derivado del hash del texto"""
+    semilla = hashlib.sha256(texto.encode("utf-8")).digest()
+    valores = []
+    while len(valores) < DIMENSION_EMBEDDINGS:
+        semilla = hashlib.sha256(semilla).digest()
+        valores.extend(b / 127.5 - 1.0 for b in semilla)
+    valores = valores[:DIMENSION_EMBEDDINGS]
+    norma = sum(v * v for v in valores) ** 0.5 or 1.0
+    return [v / norma for v in valores]
+
+
+def cuestionario_enlatado(prompt):
+    """Respuesta JSON plausible para el prompt recibido"""
+    match = re.search(r"exactamente (\d+)", prompt)
+    num_preguntas = int(match.group(1)) if match else 5
+    if "opción múltiple" in prompt and "verdadero" not in prompt:
+        tipos = ["opcion_multiple"]
+    elif "verdadero o falso" in prompt:
+        tipos = ["verdadero_falso"]
+    elif "preguntas abiertas" in prompt:
+        tipos = ["pregunta_abierta"]
+    else:
+        tipos = ["opcion_multiple", "verdadero_falso", "pregunta_abierta"]
+
+    semilla = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    preguntas = []
+    for i in range(num_preguntas):
+        tipo = tipos[i % len(tipos)]
+        pregunta = {
+            "tipo": tipo,
+            "enunciado": f"Pregunta {semilla}-{i} sobre el contenido del documento",
+            "respuesta_correcta": "Verdadero" if tipo == "verdadero_falso" else "Respuesta A",
+            "explicacion": "Explicación basada en el contexto proporcionado.",
+            "dificultad": "intermedio"
+        }
+        if tipo == "opcion_multiple":
+            pregunta["opciones"] = ["Respuesta A", "Respuesta B", "Respuesta C", "Respuesta D"]
+        preguntas.append(pregunta)
+
+    return json.dumps({
+        "cuestionario": preguntas,
+        "metadata": {"temas_cubiertos": ["tema sintético"], "total_preguntas": num_preguntas}
+    }, ensure_ascii=False)
+
+
+class FakeOllamaServer:
+    """Servidor HTTP que imita los endpoints de Ollama usados por el proyecto"""
+
+    def __init__(self, latencia_llm=0.0, latencia_token=0.0, latencia_embedding=0.0):
+        self.latencia_llm = latencia_llm
+        self.latencia_token = latencia_token
+        self.latencia_embedding = latencia_embedding
+        self.peticiones = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._hilo = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, puerto = self._httpd.server_address
+        return f"http://{host}:{puerto}"
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _contar(self, ruta):
+        with self._lock:
+            self.peticiones[ruta] = self.peticiones.get(ruta, 0) + 1
+
+    def _handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, cuerpo):
+                datos = json.dumps(cuerpo).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def _responder_stream(self, fragmentos):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for fragmento in fragmentos:
+                    linea = (json.dumps(fragmento) + "\n").encode("utf-8")
+                    self.wfile.write(f"{len(linea):x}\r\n".encode() + linea + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                servidor._contar(self.path)
+                self._responder({"models": [
+                    {"name": CONFIG["MODELO_LLM"]}, {"name": CONFIG["MODELO_EMBEDDINGS"]}
+                ]})
+
+            def do_POST(self):
+                servidor._contar(self.path)
+                longitud = int(self.headers.get("Content-Length", 0))
+                peticion = json.loads(self.rfile.read(longitud) or b"{}")
+
+                if self.path == "/api/embed":
+                    entradas = peticion.get("input", [])
+                    entradas = [entradas] if isinstance(entradas, str) else entradas
+                    time.sleep(servidor.latencia_embedding)
+                    self._responder({"embeddings": [embedding_determinista(t) for t in entradas]})
+                elif self.path == "/api/embeddings":
+                    time.sleep(servidor.latencia_embedding)
+                    self._responder({"embedding": embedding_determinista(peticion.get("prompt", ""))})
+                elif self.path == "/api/generate":
+                    self._responder({"model": peticion.get("model"), "response": "", "done": True})
+                elif self.path == "/api/chat":
+                    prompt = "\n".join(m.get("content", "") for m in peticion.get("messages", []))
+                    self._chat(peticion, prompt)
+                else:
+                    self.send_error(404)
+
+            def _chat(self, peticion, prompt):
+                texto = cuestionario_enlatado(prompt)
+                tokens = re.findall(r"\S+\s*", texto)
+                time.sleep(servidor.latencia_llm)
+                base = {"model": peticion.get("model"), "created_at": datetime.now().isoformat()}
+
+                def fragmentos():
+                    for token in tokens:
+                        time.sleep(servidor.latencia_token)
+                        yield {**base, "message": {"role": "assistant", "content": token}, "done": False}
+                    yield {
+                        **base, "message": {"role": "assistant", "content": ""}, "done": True,
+                        "done_reason": "stop", "prompt_eval_count": len(prompt) // 4,
+                        "eval_count": len(tokens)
+                    }
+
+                if peticion.get("stream", True):
+                    self._responder_stream(fragmentos())
+                else:
+                    respuesta = {**base, "message": {"role": "assistant", "content": ""}}
+                    for fragmento in fragmentos():
+                        respuesta["message"]["content"] += fragmento["message"]["content"]
+                        respuesta.update({k: v for k, v in fragmento.items() if k != "message"})
+                    self._responder(respuesta)
+
+        return Handler
+
+
+def generar_pdf_sintetico(path, paginas):
+    """PDF de texto con títulos y párrafos repetibles"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=letter)
+    _, alto = letter
+    for pagina in range(paginas):
+        y = alto - 60
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(50, y, f"Capítulo {pagina + 1}: Tema sintético {pagina % 7}")
+        c.setFont("Helvetica", 10)
+        for linea in range(40):
+            y -= 16
+            c.drawString(
+                50, y,
+                f"Línea {linea} de la página {pagina + 1}: la célula {linea % 13} realiza "
+                f"el proceso {pagina % 11} descrito en la sección {linea % 5}."
+            )
+        c.showPage()
+    c.save()
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def medir(funcion, repeticiones=1, unidades=1):
+    """Ejecuta ``funcion`` y resume tiempos, rendimiento y pico de memoria.
+
+    tracemalloc ralentiza cada asignación, así que los tiempos se toman sin
+    él y el pico de memoria sale de una pasada adicional, no cronometrada,
+    con índice ``repeticiones``.
+    """
+    tiempos = []
+    resultado = None
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(i)
+        tiempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    try:
+        funcion(repeticiones)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    total = sum(tiempos)
+    resumen = {
+        "repeticiones": repeticiones,
+        "total_s": round(total, 4),
+        "p50_ms": round(percentil(tiempos, 50) * 1000, 2),
+        "p95_ms": round(percentil(tiempos, 95) * 1000, 2),
+        "media_ms": round(statistics.mean(tiempos) * 1000, 2),
+        "rendimiento_por_s": round(unidades * repeticiones / total, 2) if total else None,
+        "pico_memoria_mb": round(pico / 2**20, 2)
+    }
+    return resultado, resumen
+
+
+def ejecutar(args):
+    from document_processor import DocumentProcessor
+    from vector_db import VectorDatabase
+    from quiz_generator import QuizGenerator
+
+    resultados = {}
+    for paginas in args.paginas:
+        etapas = {}
+        pdf_path = os.path.join(CONFIG["DB_DIR"], f"sintetico_{paginas}.pdf")
+        generar_pdf_sintetico(pdf_path, paginas)
+        logger.info(f"Benchmark con {paginas} páginas")
+
+        chunks, etapas["parseo"] = medir(
+            lambda _: DocumentProcessor().load_and_split(pdf_path), unidades=paginas
+        )
+        if not chunks:
+            raise RuntimeError(f"No se pudo parsear {pdf_path}")
+        etapas["parseo"]["chunks"] = len(chunks)
+        etapas["parseo"]["bytes"] = sum(len(c.page_content.encode("utf-8")) for c in chunks)
+        # Sin p50: ``comparar`` no lo trata como etapa
+        etapas["troceado"] = DocumentProcessor().compare_splitters(pdf_path)
+
+        db = VectorDatabase()
+        nombre = f"bench_{paginas}"
+        # Una base por pasada: la de memoria no duplica los chunks de la medida
+        _, etapas["create_db"] = medir(
+            lambda i: db.create_db(chunks, nombre if i == 0 else f"{nombre}_{i}"), unidades=len(chunks)
+        )
+        vector_db, etapas["load_db"] = medir(lambda _: db.load_db(nombre))
+
+        retriever = vector_db.as_retriever(search_kwargs={"k": 5})
+        _, etapas["recuperacion"] = medir(
+            lambda i: retriever.invoke(f"proceso {i} de la célula"), repeticiones=args.consultas
+        )
+
+        generador = QuizGenerator(retriever)
+        # fresh: se mide la generación con el LLM, no el banco de preguntas
+        _, etapas["generacion"] = medir(
+            lambda i: generador.generate_quiz(
+                topic=f"tema sintético {i}", num_questions=args.preguntas, percentages=(40, 40, 20),
+                fresh=True
+            ),
+            repeticiones=args.cuestionarios, unidades=args.preguntas
+        )
+        resultados[f"{paginas}_paginas"] = etapas
+    return resultados
+
+
+def comparar(actual, base, umbral):
+    """Imprime la variación de p50 por etapa y devuelve las regresiones"""
+    regresiones = []
+    for escenario, etapas in actual.items():
+        for etapa, datos in etapas.items():
+            previo = base.get(escenario, {}).get(etapa)
+            if not previo or not previo.get("p50_ms"):
+                continue
+            cambio = (datos["p50_ms"] - previo["p50_ms"]) / previo["p50_ms"]
+            marca = "⚠️" if cambio > umbral else "  "
+            print(f"{marca} {escenario:>14} {etapa:<14} p50 {previo['p50_ms']:>10.2f} → "
+                  f"{datos['p50_ms']:>10.2f} ms ({cambio:+.1%})")
+            if cambio > umbral:
+                regresiones.append((escenario, etapa, cambio))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del generador de cuestionarios")
+    parser.add_argument("--paginas", type=int, nargs="+", default=[10, 50], help="Tamaños de PDF sintético")
+    parser.add_argument("--consultas", type=int, default=50, help="Consultas de recuperación por escenario")
+    parser.add_argument("--cuestionarios", type=int, default=5, help="Cuestionarios generados por escenario")
+    parser.add_argument("--preguntas", type=int, default=10, help="Preguntas por cuestionario")
+    parser.add_argument("--latencia-llm", type=float, default=0.2, help="Latencia inicial del LLM (s)")
+    parser.add_argument("--latencia-token", type=float, default=0.002, help="Latencia por token (s)")
+    parser.add_argument("--latencia-embedding", type=float, default=0.01, help="Latencia por llamada de embeddings (s)")
+    parser.add_argument("--salida", default="bench_output.json", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=0.2, help="Empeoramiento de p50 considerado regresión")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp, FakeOllamaServer(
+        args.latencia_llm, args.latencia_token, args.latencia_embedding
+    ) as servidor:
+        # Directorios aislados: ninguna caché previa altera las mediciones
+        CONFIG.update({
+            "OLLAMA_URL": servidor.url,
+            "DB_DIR": os.path.join(tmp, "vector_db"),
+            "CACHE_DIR": os.path.join(tmp, "cache"),
+            "BANCO_PATH": os.path.join(tmp, "banco", "preguntas.sqlite")
+        })
+        os.makedirs(CONFIG["DB_DIR"], exist_ok=True)
+
+        resultados = {
+            "fecha": datetime.now().isoformat(),
+            "entorno": {"python": platform.python_version(), "plataforma": platform.platform()},
+            "parametros": vars(args),
+            "escenarios": ejecutar(args),
+            "peticiones_ollama": servidor.peticiones
+        }
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, ensure_ascii=False, indent=2)
+    print(json.dumps(resultados["escenarios"], ensure_ascii=False, indent=2))
+    print(f"💾 Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = comparar(resultados["escenarios"], base.get("escenarios", {}), args.umbral)
+        if regresiones:
+            print(f"\n⚠️ {len(regresiones)} regresiones por encima del {args.umbral:.0%}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import os
+import json
+import random
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+from array import array
+from langchain_core.embeddings import Embeddings
+from config import CONFIG
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Al desalojar se deja este margen libre bajo el límite, para no contar
+# ni borrar en cada escritura una vez que la caché está llena
+MARGEN_DESALOJO = 0.1
+
+
+def _desalojar_lru(conn, tabla, columna, max_entries):
+    """Borra las entradas menos usadas si ``tabla`` supera ``max_entries``.
+
+    Devuelve (entradas que quedan, entradas borradas).
+    """
+    total = conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+    if total <= max_entries:
+        return total, 0
+    exceso = total - int(max_entries * (1 - MARGEN_DESALOJO))
+    conn.execute(
+        f"DELETE FROM {tabla} WHERE {columna} IN ("
+        f" SELECT {columna} FROM {tabla} ORDER BY ultimo_acceso ASC LIMIT ?)",
+        (exceso,)
+    )
+    return total - exceso, exceso
+
+
+def hash_texto(*partes):
+    """Hash estable (sha256) de una secuencia de textos"""
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(str(parte).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """Almacén persistente de embeddings en SQLite con desalojo LRU"""
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.path.join(CONFIG["CACHE_DIR"], "embeddings.sqlite")
+        self.max_entries = max_entries or CONFIG["CACHE_EMBEDDINGS_MAX"]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " clave TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " ultimo_acceso REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ultimo_acceso ON embeddings (ultimo_acceso)"
+        )
+        self._conn.commit()
+        # Cota superior de las entradas: sólo se cuentan de verdad al pasar el límite
+        self._entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, claves):
+        """Devuelve {clave: vector} para las claves presentes en caché"""
+        encontrados = {}
+        if not claves:
+            return encontrados
+
+        with self._lock:
+            unicas = list(dict.fromkeys(claves))
+            # SQLite limita el número de parámetros por consulta
+            for i in range(0, len(unicas), 500):
+                lote = unicas[i:i + 500]
+                marcas = ",".join("?" * len(lote))
+                filas = self._conn.execute(
+                    f"SELECT clave, vector FROM embeddings WHERE clave IN ({marcas})", lote
+                ).fetchall()
+                for clave, blob in filas:
+                    encontrados[clave] = array("d", blob).tolist()
+
+            if encontrados:
+                ahora = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET ultimo_acceso = ? WHERE clave = ?",
+                    [(ahora, clave) for clave in encontrados]
+                )
+                self._conn.commit()
+
+            aciertos = sum(1 for c in claves if c in encontrados)
+            self.hits += aciertos
+            self.misses += len(claves) - aciertos
+        metrics.contar("cache_aciertos_total", aciertos, cache="embeddings")
+        metrics.contar("cache_fallos_total", len(claves) - aciertos, cache="embeddings")
+        return encontrados
+
+    def put_many(self, items):
+        """Guarda pares (clave, vector) y aplica el límite de tamaño"""
+        if not items:
+            return
+
+        with self._lock:
+            ahora = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (clave, vector, ultimo_acceso) VALUES (?, ?, ?)",
+                [(clave, array("d", vector).tobytes(), ahora) for clave, vector in items]
+            )
+            # Los reemplazos también suman: la cuenta nunca se queda corta
+            self._entradas += len(items)
+            if self._entradas > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._entradas, exceso = _desalojar_lru(self._conn, "embeddings", "clave", self.max_entries)
+        if exceso:
+            logger.info(f"Caché de embeddings: {exceso} entradas desalojadas")
+
+    def stats(self):
+        """Contadores de aciertos/fallos y tamaño actual"""
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        consultas = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / consultas if consultas else 0.0,
+            "entradas": total
+        }
+
+
+class QuizCache:
+    """Caché persistente de cuestionarios en SQLite con TTL y variantes.
+
+    Cada clave puede guardar hasta ``variantes`` resultados distintos; mientras
+    no se alcance ese número ``get`` devuelve None para que se genere una
+    variante nueva, y después sirve una al azar para mantener la diversidad.
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=None, variantes=None):
+        self.path = path or os.path.join(CONFIG["CACHE_DIR"], "cuestionarios.sqlite")
+        self.ttl = ttl or CONFIG["CACHE_CUESTIONARIOS_TTL"]
+        self.max_entries = max_entries or CONFIG["CACHE_CUESTIONARIOS_MAX"]
+        self.variantes = variantes or CONFIG["CACHE_CUESTIONARIOS_VARIANTES"]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cuestionarios ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " clave TEXT NOT NULL,"
+            " resultado TEXT NOT NULL,"
+            " creado REAL NOT NULL,"
+            " ultimo_acceso REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_clave ON cuestionarios (clave)")
+        self._conn.commit()
+        # Cota superior de las entradas: sólo se cuentan de verdad al pasar el límite
+        self._entradas = self._conn.execute("SELECT COUNT(*) FROM cuestionarios").fetchone()[0]
+
+    def get(self, clave):
+        """Devuelve una variante cacheada o None si hay que generar otra"""
+        with self._lock:
+            limite = time.time() - self.ttl
+            filas = self._conn.execute(
+                "SELECT id, resultado FROM cuestionarios WHERE clave = ? AND creado >= ?",
+                (clave, limite)
+            ).fetchall()
+
+            if len(filas) < self.variantes:
+                self.misses += 1
+                metrics.contar("cache_fallos_total", cache="cuestionarios")
+                return None
+
+            fila_id, resultado = random.choice(filas)
+            self._conn.execute(
+                "UPDATE cuestionarios SET ultimo_acceso = ? WHERE id = ?", (time.time(), fila_id)
+            )
+            self._conn.commit()
+            self.hits += 1
+        metrics.contar("cache_aciertos_total", cache="cuestionarios")
+        return json.loads(resultado)
+
+    def put(self, clave, resultado):
+        """Guarda una variante y aplica TTL y límite de tamaño"""
+        with self._lock:
+            ahora = time.time()
+            self._conn.execute(
+                "INSERT INTO cuestionarios (clave, resultado, creado, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                (clave, json.dumps(resultado, ensure_ascii=False), ahora, ahora)
+            )
+            # Sólo se conservan las variantes más recientes de cada clave
+            self._conn.execute(
+                "DELETE FROM cuestionarios WHERE clave = ? AND id NOT IN ("
+                " SELECT id FROM cuestionarios WHERE clave = ? ORDER BY creado DESC LIMIT ?)",
+                (clave, clave, self.variantes)
+            )
+            self._conn.execute("DELETE FROM cuestionarios WHERE creado < ?", (ahora - self.ttl,))
+
+            self._entradas += 1
+            if self._entradas > self.max_entries:
+                self._entradas, _ = _desalojar_lru(self._conn, "cuestionarios", "id", self.max_entries)
+            self._conn.commit()
+
+    def stats(self):
+        """Contadores de aciertos/fallos y tamaño actual"""
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM cuestionarios").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entradas": total}
+
+
+class CachedEmbeddings(Embeddings):
+    """Envuelve un objeto de embeddings y sólo calcula los textos no cacheados"""
+
+    def __init__(self, embeddings, model_name, cache=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+
+    def _clave(self, texto):
+        return hash_texto(self.model_name, texto)
+
+    def _lookup(self, texts):
+        """Separa los textos en cacheados y pendientes (sin repetir)"""
+        claves = [self._clave(t) for t in texts]
+        encontrados = self.cache.get_many(claves)
+
+        pendientes = {}
+        for clave, texto in zip(claves, texts):
+            if clave not in encontrados and clave not in pendientes:
+                pendientes[clave] = texto
+        return claves, encontrados, pendientes
+
+    def _store(self, claves, encontrados, pendientes, vectores):
+        nuevos = list(zip(pendientes.keys(), vectores))
+        self.cache.put_many(nuevos)
+        encontrados.update(nuevos)
+        return [encontrados[clave] for clave in claves]
+
+    def _record_call(self, pendientes):
+        metrics.contar("embeddings_llamadas_total", modelo=self.model_name)
+        metrics.contar("embeddings_textos_total", len(pendientes), modelo=self.model_name)
+
+    def embed_documents(self, texts):
+        claves, encontrados, pendientes = self._lookup(texts)
+        vectores = []
+        if pendientes:
+            with metrics.medir("embeddings", modelo=self.model_name):
+                vectores = self.embeddings.embed_documents(list(pendientes.values()))
+            self._record_call(pendientes)
+        return self._store(claves, encontrados, pendientes, vectores)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        claves, encontrados, pendientes = self._lookup(texts)
+        vectores = []
+        if pendientes:
+            with metrics.medir("embeddings", modelo=self.model_name):
+                vectores = await self.embeddings.aembed_documents(list(pendientes.values()))
+            self._record_call(pendientes)
+        return self._store(claves, encontrados, pendientes, vectores)
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,158 @@
+import re
+import logging
+from collections import defaultdict
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from config import CONFIG
+from context_builder import estimar_tokens
+
+logger = logging.getLogger(__name__)
+
+# Categorías de unstructured que nunca aportan contenido
+CATEGORIAS_RUIDO = {"Header", "Footer", "PageNumber", "PageBreak"}
+
+# Metadatos propios de un elemento que no tienen sentido en un chunk combinado
+_METADATOS_ELEMENTO = {
+    "element_id", "parent_id", "category", "category_depth", "coordinates",
+    "detection_class_prob", "text_as_html", "emphasized_text_contents",
+    "emphasized_text_tags", "links", "points", "system", "layout_width", "layout_height"
+}
+
+_NUMERO_PAGINA = re.compile(
+    r"^\s*(p[aá]g(ina)?\.?|page|p\.)?\s*[-–—]?\s*\d{1,4}\s*[-–—]?\s*((/|de|of)\s*\d{1,4})?\s*$",
+    re.IGNORECASE
+)
+# Números de página pegados a un encabezado o pie ("3 Biología celular", "Tema 2 | 14")
+_NUMERO_BORDE = re.compile(r"^[\d\s|·•\-–—]+|[\d\s|·•\-–—]+$")
+
+MAX_CARACTERES_RUIDO = 120   # los encabezados y pies repetidos son líneas cortas
+ELEMENTOS_BORDE = 2          # elementos de cada extremo de la página que pueden ser encabezado o pie
+FRACCION_PAGINAS_RUIDO = 0.4   # un encabezado se repite en casi todas las páginas; un "Capítulo N", no
+
+
+def _clave_ruido(texto):
+    return " ".join(_NUMERO_BORDE.sub("", texto.lower()).split())
+
+
+def _pagina(doc):
+    return doc.metadata.get("page_number") or 0
+
+
+class StructuredChunker:
+    """Agrupa los elementos de unstructured en chunks por secciones.
+
+    Los elementos consecutivos se unen hasta ``max_tokens`` y un ``Title``
+    abre un chunk nuevo; los títulos seguidos (capítulo y apartado) forman
+    la sección, que se guarda en ``metadata["seccion"]`` de cada chunk.
+    Antes se descartan los números de página, los elementos marcados como
+    encabezado o pie y las líneas cortas que se repiten al principio o al
+    final de al menos ``min_paginas_ruido`` páginas (y de buena parte de
+    las vistas, para no confundir con ruido los "Capítulo N").
+
+    Se puede alimentar por ventanas de páginas con ``feed``: la sección en
+    curso y los textos repetidos ya vistos pasan de una ventana a la
+    siguiente. ``flush`` devuelve el último chunk.
+    """
+
+    def __init__(self, max_tokens=None, min_paginas_ruido=None):
+        self.max_tokens = max_tokens or CONFIG["CHUNK_TOKENS"]
+        self.min_paginas_ruido = min_paginas_ruido or CONFIG["RUIDO_MIN_PAGINAS"]
+        # Elementos demasiado grandes para el presupuesto se dividen por caracteres
+        self._splitter = RecursiveCharacterTextSplitter(chunk_size=self.max_tokens * 4, chunk_overlap=0)
+        self._paginas_borde = defaultdict(set)   # texto normalizado -> páginas en las que aparece en un borde
+        self._paginas = set()
+        self._elementos = []
+        self._tokens = 0
+        self._con_cuerpo = False
+        self._titulos = []
+        self.descartados = 0
+
+    def split(self, elements):
+        """Chunks de un documento completo"""
+        return self.feed(elements) + self.flush()
+
+    def feed(self, elements):
+        """Añade los elementos de una o varias páginas y devuelve los chunks completos"""
+        chunks = []
+        for doc in self._filter_noise(elements):
+            texto = doc.page_content.strip()
+            if doc.metadata.get("category") == "Title":
+                if self._con_cuerpo:
+                    chunks.extend(self._emit())
+                    self._titulos = []
+                self._titulos = (self._titulos + [texto])[-3:]
+            else:
+                tokens = estimar_tokens(texto)
+                if self._con_cuerpo and self._tokens + tokens > self.max_tokens:
+                    chunks.extend(self._emit())
+                self._con_cuerpo = True
+            self._elementos.append(doc)
+            self._tokens += estimar_tokens(texto)
+        return chunks
+
+    def flush(self):
+        """Devuelve el chunk pendiente"""
+        return self._emit()
+
+    def _filter_noise(self, elements):
+        elements = [doc for doc in elements if doc.page_content.strip()]
+        por_pagina = defaultdict(list)
+        for doc in elements:
+            por_pagina[_pagina(doc)].append(doc)
+        self._paginas.update(por_pagina)
+
+        # Candidatos a encabezado o pie: elementos cortos en los extremos de cada página
+        bordes = set()
+        for pagina, docs in por_pagina.items():
+            extremos = docs[:ELEMENTOS_BORDE] + docs[-ELEMENTOS_BORDE:]
+            for doc in extremos:
+                if len(doc.page_content) <= MAX_CARACTERES_RUIDO:
+                    clave = _clave_ruido(doc.page_content)
+                    if clave:
+                        self._paginas_borde[clave].add(pagina)
+                        bordes.add(id(doc))
+
+        utiles = []
+        for doc in elements:
+            texto = doc.page_content.strip()
+            if (
+                doc.metadata.get("category") in CATEGORIAS_RUIDO
+                or _NUMERO_PAGINA.match(texto)
+                or (id(doc) in bordes and self._repeated(_clave_ruido(texto)))
+            ):
+                self.descartados += 1
+                continue
+            utiles.append(doc)
+        return utiles
+
+    def _repeated(self, clave):
+        paginas = len(self._paginas_borde[clave])
+        return paginas >= self.min_paginas_ruido and paginas >= FRACCION_PAGINAS_RUIDO * len(self._paginas)
+
+    def _emit(self):
+        if not self._elementos:
+            return []
+        elementos = self._elementos
+        metadata = {k: v for k, v in elementos[0].metadata.items() if k not in _METADATOS_ELEMENTO}
+        paginas = [_pagina(doc) for doc in elementos if _pagina(doc)]
+        if paginas:
+            metadata["page_number"] = min(paginas)
+            metadata["pagina_final"] = max(paginas)
+        if self._titulos:
+            metadata["seccion"] = " > ".join(self._titulos)
+        metadata["category"] = "CompositeElement"
+
+        texto = "\n".join(doc.page_content.strip() for doc in elementos)
+        self._elementos, self._tokens, self._con_cuerpo = [], 0, False
+
+        if estimar_tokens(texto) <= self.max_tokens:
+            return [Document(page_content=texto, metadata=metadata)]
+        return [Document(page_content=parte, metadata=dict(metadata)) for parte in self._splitter.split_text(texto)]
+
+
+def chunk_report(chunks):
+    """Número de chunks y bytes de texto"""
+    return {
+        "chunks": len(chunks),
+        "bytes": sum(len(c.page_content.encode("utf-8")) for c in chunks)
+    }
@@ -0,0 +1,152 @@
+import logging
+import re
+import threading
+import time
+import httpx
+import ollama
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+from config import CONFIG
+from cache import CachedEmbeddings, EmbeddingCache, QuizCache
+
+logger = logging.getLogger(__name__)
+
+# Registro de clientes compartidos por todo el proceso
+_lock = threading.Lock()
+_clientes = {}
+
+
+def _client_kwargs():
+    """Opciones httpx: pool de conexiones keep-alive y timeout comunes"""
+    return {
+        "timeout": CONFIG["OLLAMA_TIMEOUT"],
+        "limits": httpx.Limits(
+            max_connections=CONFIG["OLLAMA_MAX_CONEXIONES"],
+            max_keepalive_connections=CONFIG["OLLAMA_MAX_CONEXIONES"]
+        )
+    }
+
+
+def _shared(clave, crear):
+    with _lock:
+        if clave not in _clientes:
+            _clientes[clave] = crear()
+        return _clientes[clave]
+
+
+def get_llm(**opciones):
+    """ChatOllama compartido para el modelo configurado y las opciones dadas"""
+    clave = ("llm", CONFIG["MODELO_LLM"], tuple(sorted(opciones.items())))
+    return _shared(clave, lambda: ChatOllama(
+        model=CONFIG["MODELO_LLM"],
+        base_url=CONFIG["OLLAMA_URL"],
+        keep_alive=CONFIG["OLLAMA_KEEP_ALIVE"],
+        client_kwargs=_client_kwargs(),
+        **opciones
+    ))
+
+
+class KeepAliveOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings que envía ``OLLAMA_KEEP_ALIVE`` en cada petición.
+
+    La versión de langchain-ollama no lo envía, y cada petición de
+    embeddings devolvía el modelo a la caducidad por defecto de Ollama.
+    """
+
+    def embed_documents(self, texts):
+        return self._client.embed(self.model, texts, keep_alive=CONFIG["OLLAMA_KEEP_ALIVE"])["embeddings"]
+
+    async def aembed_documents(self, texts):
+        respuesta = await self._async_client.embed(self.model, texts, keep_alive=CONFIG["OLLAMA_KEEP_ALIVE"])
+        return respuesta["embeddings"]
+
+
+def _ollama_embeddings():
+    return KeepAliveOllamaEmbeddings(
+        model=CONFIG["MODELO_EMBEDDINGS"],
+        base_url=CONFIG["OLLAMA_URL"],
+        client_kwargs=_client_kwargs()
+    ), CONFIG["MODELO_EMBEDDINGS"]
+
+
+def _local_embeddings():
+    from local_embeddings import SentenceTransformerEmbeddings
+    modelo = CONFIG["MODELO_EMBEDDINGS_LOCAL"]
+    return SentenceTransformerEmbeddings(modelo), f"st:{modelo}"
+
+
+# Backends de embeddings: nombre -> función que devuelve (embeddings, nombre del modelo)
+_backends = {
+    "ollama": _ollama_embeddings,
+    "sentence_transformers": _local_embeddings
+}
+
+
+def register_embeddings_backend(nombre, crear):
+    """Añade un backend seleccionable con CONFIG["EMBEDDINGS_BACKEND"]"""
+    _backends[nombre] = crear
+
+
+def embeddings_namespace():
+    """Sufijo de los índices del backend activo ("" para Ollama).
+
+    Cada backend produce vectores de otra dimensión, así que sus colecciones
+    se guardan aparte para no mezclarlos.
+    """
+    backend = CONFIG["EMBEDDINGS_BACKEND"]
+    if backend == "ollama":
+        return ""
+    modelo = CONFIG["MODELO_EMBEDDINGS_LOCAL"] if backend == "sentence_transformers" else ""
+    return "_" + re.sub(r"\W+", "_", f"{backend}_{modelo}".lower()).strip("_")
+
+
+def get_embeddings():
+    """Embeddings compartidos del backend configurado, envueltos en la caché en disco"""
+    backend = CONFIG["EMBEDDINGS_BACKEND"]
+    if backend not in _backends:
+        raise ValueError(f"Backend de embeddings desconocido: {backend}")
+
+    def crear():
+        embeddings, modelo = _backends[backend]()
+        return CachedEmbeddings(embeddings, model_name=modelo, cache=EmbeddingCache())
+
+    return _shared(("embeddings", backend, embeddings_namespace(), CONFIG["MODELO_EMBEDDINGS"]), crear)
+
+
+def get_quiz_cache():
+    """Caché de cuestionarios compartida (una conexión SQLite por proceso)"""
+    return _shared(("quiz_cache",), QuizCache)
+
+
+def get_question_bank():
+    """Banco de preguntas compartido (una conexión SQLite por proceso)"""
+    from question_bank import QuestionBank
+    return _shared(("question_bank",), QuestionBank)
+
+
+def get_job_queue():
+    """Cola de trabajos de generación compartida por el proceso"""
+    from jobs import JobQueue
+    return _shared(("job_queue",), JobQueue)
+
+
+def warm_up():
+    """Carga en Ollama el LLM y el modelo de embeddings antes de la primera petición.
+
+    Una petición vacía hace que Ollama cargue el modelo y lo mantenga
+    residente durante ``OLLAMA_KEEP_ALIVE``. Los fallos sólo se registran.
+    """
+    cliente = _shared(("ollama",), lambda: ollama.Client(CONFIG["OLLAMA_URL"], **_client_kwargs()))
+    inicio = time.perf_counter()
+    try:
+        cliente.generate(model=CONFIG["MODELO_LLM"], prompt="", keep_alive=CONFIG["OLLAMA_KEEP_ALIVE"])
+        if CONFIG["EMBEDDINGS_BACKEND"] == "ollama":
+            cliente.embeddings(
+                model=CONFIG["MODELO_EMBEDDINGS"], prompt="calentamiento",
+                keep_alive=CONFIG["OLLAMA_KEEP_ALIVE"]
+            )
+        else:
+            # Backend local: se carga el modelo en este proceso
+            get_embeddings().embeddings.embed_query("calentamiento")
+        logger.info(f"Modelos precargados en {time.perf_counter() - inicio:.1f}s")
+    except Exception as e:
+        logger.warning(f"No se pudieron precargar los modelos: {str(e)}")
@@ -5,10 +5,84 @@ from datetime import datetime
 CONFIG = {
     "MODELO_LLM": "llama3.2:latest",
     "MODELO_EMBEDDINGS": "nomic-embed-text",
+
+    # Backend de embeddings: "ollama" (HTTP) o "sentence_transformers" (en proceso)
+    "EMBEDDINGS_BACKEND": "ollama",
+    "MODELO_EMBEDDINGS_LOCAL": "paraphrase-multilingual-MiniLM-L12-v2",
+    "EMBEDDINGS_LOCAL_BATCH": 128,
+    "EMBEDDINGS_LOCAL_PROCESOS": 1,       # >1 reparte la ingesta entre procesos (lotes de BATCH * PROCESOS)
+    "EMBEDDINGS_LOCAL_DISPOSITIVO": "cpu",
+
+    # Clientes Ollama compartidos
+    "OLLAMA_URL": None,              # None = http://localhost:11434 (o OLLAMA_HOST)
+    "OLLAMA_KEEP_ALIVE": "30m",      # tiempo que Ollama mantiene los modelos cargados
+    "OLLAMA_TIMEOUT": 60,
+    "OLLAMA_MAX_CONEXIONES": 16,     # conexiones HTTP keep-alive por cliente
+    # Troceado por secciones: elementos de unstructured unidos hasta CHUNK_TOKENS
+    "CHUNKING_ESTRUCTURAL": True,   # False = ventanas fijas de CHUNK_SIZE/CHUNK_OVERLAP caracteres
+    "CHUNK_TOKENS": 400,
+    "RUIDO_MIN_PAGINAS": 3,         # páginas en las que se repite un encabezado o pie para descartarlo
     "CHUNK_SIZE": 1200,
     "CHUNK_OVERLAP": 300,
+    "PAGINAS_POR_VENTANA": 4,   # páginas parseadas a la vez en modo streaming
+    "INGESTA_WORKERS": os.cpu_count() or 1,   # procesos para parsear varios PDF
+    "APP_INDICES_MAX": 16,     # índices abiertos en memoria compartidos por las sesiones de la app
+    "APP_SONDEO": 0.5,         # segundos entre consultas del estado de un trabajo en la app
+
+    # Cola de trabajos de generación (app): peticiones idénticas en curso se comparten
+    "COLA_WORKERS": 2,         # cuestionarios a la vez; ajustar a OLLAMA_NUM_PARALLEL
+    "COLA_RETENCION": 600,     # segundos que se conserva un trabajo terminado para consultarlo
     "DB_DIR": "./vector_db",
-    "MAX_PREGUNTAS": 20
+    "MAX_PREGUNTAS": 20,
+    "CONTEXTO_MAX_TOKENS": 1500,        # presupuesto (estimado) del contexto en el prompt
+    "CONTEXTO_EXTRAER_FRASES": False,   # conservar sólo las frases más relevantes para el tema
+
+    # Recuperación por cobertura: chunks diversos (MMR) proporcionales a las preguntas
+    "RECUPERACION_COBERTURA": True,
+    "CHUNKS_POR_PREGUNTA": 1,
+    "RECUPERACION_K_MAX": 40,
+    "MMR_LAMBDA": 0.5,         # 1 = sólo relevancia, 0 = sólo diversidad
+
+    # Recuperación híbrida: índice BM25 junto a cada colección + búsqueda vectorial
+    "RECUPERACION_MODO": "hibrido",     # "hibrido", "lexico" (sólo BM25) o "vectorial"
+    "HIBRIDO_PESO_LEXICO": 0.3,         # peso de BM25 en la fusión de puntuaciones
+    "HIBRIDO_EMBEDDINGS_EN_VUELO": 8,   # consultas simultáneas antes de pasar a sólo BM25
+    "HIBRIDO_TIMEOUT_EMBEDDING": 2.0,   # segundos de espera del embedding de la consulta
+
+    # Descarte de preguntas casi duplicadas (similitud coseno de los enunciados)
+    "DEDUP_SEMANTICO": True,
+    "DEDUP_UMBRAL": 0.92,
+    "PERFIL_DIR": None,   # directorio para perfiles cProfile de generate_quiz (None = desactivado)
+
+    # Caché de embeddings en disco (LRU por número de entradas)
+    "CACHE_DIR": "./cache",
+    "CACHE_EMBEDDINGS_MAX": 200000,
+
+    # Banco de preguntas validadas (por colección, tipo, dificultad y tema)
+    "BANCO_PREGUNTAS": True,        # guardar cada pregunta generada
+    "BANCO_ENSAMBLAR": True,        # servir primero desde el banco y generar sólo lo que falta
+    "BANCO_PATH": "./banco/preguntas.sqlite",
+    "BANCO_UMBRAL_TEMA": 0.8,       # similitud coseno mínima entre temas
+
+    # Caché de cuestionarios generados
+    "CACHE_CUESTIONARIOS_TTL": 7 * 24 * 3600,   # segundos
+    "CACHE_CUESTIONARIOS_MAX": 5000,            # entradas (variantes) como máximo
+    "CACHE_CUESTIONARIOS_VARIANTES": 1,         # variantes distintas por petición antes de reutilizar
+
+    # Pipeline de embeddings por lotes
+    "EMBEDDING_BATCH_SIZE": 64,
+    "EMBEDDING_WORKERS": 4,
+    "EMBEDDING_MAX_EN_VUELO": 8,   # lotes enviados simultáneamente como máximo
+    "EMBEDDING_REINTENTOS": 3,
+
+    # Generación paralela: un sub-trabajo por tipo y lote de preguntas
+    "GENERACION_PARALELA": True,
+    "PREGUNTAS_POR_LOTE": 5,
+    "GENERACION_WORKERS": 4,
+    "GENERACION_REINTENTOS": 2,
+
+    # Generación por lotes (batch.py)
+    "LOTE_WORKERS": 2   # cuestionarios generados a la vez; cada uno usa GENERACION_WORKERS hilos
 }
 
 # Configuración de prompts
@@ -0,0 +1,127 @@
+import re
+import logging
+from config import CONFIG
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Separa frases tras un punto final (o saltos de línea dobles)
+_FRASES = re.compile(r"(?<=[.!?;:])\s+|\n\s*\n")
+_PALABRAS = re.compile(r"\w+")
+
+
+def estimar_tokens(texto):
+    """Estimación rápida de tokens (~4 caracteres por token)"""
+    return len(texto) // 4
+
+
+def _normalizar(texto):
+    return " ".join(_PALABRAS.findall(texto.lower()))
+
+
+class ContextBuilder:
+    """Construye el contexto del prompt dentro de un presupuesto de tokens.
+
+    Los fragmentos recuperados se recorren por orden de relevancia, se
+    eliminan las frases ya incluidas (el solapamiento entre chunks
+    contiguos) y se empaquetan hasta ``max_tokens``. Con ``extraer_frases``
+    sólo se conservan las frases que comparten más términos con el tema.
+    """
+
+    def __init__(self, max_tokens=None, extraer_frases=None):
+        self.max_tokens = max_tokens or CONFIG["CONTEXTO_MAX_TOKENS"]
+        self.extraer_frases = (
+            CONFIG["CONTEXTO_EXTRAER_FRASES"] if extraer_frases is None else extraer_frases
+        )
+
+    @staticmethod
+    def _split(texto):
+        return [f.strip() for f in _FRASES.split(texto) if f and f.strip()]
+
+    @staticmethod
+    def _score(frase, terminos):
+        palabras = set(_PALABRAS.findall(frase.lower()))
+        return len(palabras & terminos) / (1 + len(palabras)) ** 0.5
+
+    def _dedup(self, docs):
+        """Frases de cada documento, sin las ya vistas en documentos anteriores"""
+        vistas = set()
+        incluido = ""
+        bloques = []
+        for doc in docs:
+            frases = []
+            for frase in self._split(doc.page_content):
+                normal = _normalizar(frase)
+                if not normal or normal in vistas:
+                    continue
+                # Fragmento cortado por el solapamiento: ya está dentro de otra frase
+                if len(normal) < len(incluido) and normal in incluido:
+                    continue
+                vistas.add(normal)
+                incluido += " " + normal
+                frases.append(frase)
+            if frases:
+                bloques.append(frases)
+        return bloques
+
+    def _extract(self, bloques, topic):
+        """Conserva las frases más relevantes para el tema, en su orden original"""
+        terminos = {p for p in _PALABRAS.findall(topic.lower()) if len(p) > 2}
+        if not terminos:
+            return bloques
+
+        candidatas = sorted(
+            ((self._score(frase, terminos), i, j)
+             for i, frases in enumerate(bloques)
+             for j, frase in enumerate(frases)),
+            key=lambda c: (-c[0], c[1], c[2])
+        )
+        if not candidatas or candidatas[0][0] == 0:
+            return bloques
+
+        elegidas, tokens = set(), 0
+        for _, i, j in candidatas:
+            coste = estimar_tokens(bloques[i][j]) + 1
+            if tokens + coste > self.max_tokens:
+                continue
+            elegidas.add((i, j))
+            tokens += coste
+
+        return [
+            [frase for j, frase in enumerate(frases) if (i, j) in elegidas]
+            for i, frases in enumerate(bloques)
+        ]
+
+    def build(self, docs, topic=""):
+        """Devuelve el texto de contexto para ``docs`` (ordenados por relevancia)"""
+        if not docs:
+            return ""
+
+        original = sum(estimar_tokens(doc.page_content) for doc in docs)
+        bloques = self._dedup(docs)
+        if self.extraer_frases:
+            bloques = self._extract(bloques, topic)
+
+        partes, tokens = [], 0
+        for frases in bloques:
+            seleccion = []
+            for frase in frases:
+                coste = estimar_tokens(frase) + 1
+                if tokens + coste > self.max_tokens:
+                    if tokens == 0:
+                        # Una sola frase mayor que el presupuesto: se recorta
+                        seleccion.append(frase[:self.max_tokens * 4])
+                        tokens = self.max_tokens
+                    break
+                seleccion.append(frase)
+                tokens += coste
+            if seleccion:
+                partes.append(" ".join(seleccion))
+            if tokens >= self.max_tokens:
+                break
+
+        context = "\n\n".join(partes)
+        metrics.contar("contexto_tokens_total", estimar_tokens(context))
+        metrics.contar("contexto_tokens_ahorrados_total", max(original - estimar_tokens(context), 0))
+        logger.debug(f"Contexto: {original} -> {estimar_tokens(context)} tokens estimados")
+        return context
@@ -0,0 +1,54 @@
+import logging
+import numpy as np
+from config import CONFIG
+from clients import get_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateFilter:
+    """Detecta preguntas casi duplicadas (paráfrasis) por similitud coseno.
+
+    Los enunciados se embeben en una sola llamada y la matriz de
+    similitudes se calcula de una vez con NumPy; se conserva la primera
+    pregunta de cada grupo de paráfrasis.
+    """
+
+    def __init__(self, embeddings=None, umbral=None):
+        self._embeddings = embeddings
+        self.umbral = umbral or CONFIG["DEDUP_UMBRAL"]
+
+    @property
+    def embeddings(self):
+        # Se resuelve al usarlo: el cliente compartido no se crea si no hace falta
+        if self._embeddings is None:
+            self._embeddings = get_embeddings()
+        return self._embeddings
+
+    def split(self, preguntas, previas=()):
+        """Separa ``preguntas`` en (conservadas, duplicadas).
+
+        Las ``previas`` (ya aceptadas) cuentan como conservadas: una pregunta
+        nueva parecida a alguna de ellas también se descarta.
+        """
+        preguntas, previas = list(preguntas), list(previas)
+        if not preguntas or len(preguntas) + len(previas) < 2:
+            return preguntas, []
+
+        textos = [str(p.get("enunciado", "")) for p in previas + preguntas]
+        vectores = np.array(self.embeddings.embed_documents(textos), dtype=float)
+        normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+        vectores /= np.where(normas == 0, 1, normas)
+        similitud = vectores @ vectores.T
+
+        aceptadas = np.zeros(len(textos), dtype=bool)
+        aceptadas[:len(previas)] = True
+        for i in range(len(previas), len(textos)):
+            aceptadas[i] = not (similitud[i, aceptadas] >= self.umbral).any()
+
+        conservadas, duplicadas = [], []
+        for pregunta, aceptada in zip(preguntas, aceptadas[len(previas):]):
+            (conservadas if aceptada else duplicadas).append(pregunta)
+        if duplicadas:
+            logger.info(f"{len(duplicadas)} preguntas casi duplicadas descartadas")
+        return conservadas, duplicadas
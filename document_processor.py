@@ -1,13 +1,23 @@
 import os
+import io
 from datetime import datetime
 import logging
-from langchain_community.document_loaders import UnstructuredPDFLoader
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores.utils import filter_complex_metadata
 from config import CONFIG
+from chunking import StructuredChunker, chunk_report
+from metrics import metrics
+from lazy import lazy_import
 
 logger = logging.getLogger(__name__)
 
+def _load_file(file_path):
+    """Punto de entrada de los procesos del pool de ingesta"""
+    return file_path, DocumentProcessor().load_and_split(file_path)
+
 class DocumentProcessor:
     def __init__(self):
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -15,6 +25,39 @@ class DocumentProcessor:
             chunk_overlap=CONFIG["CHUNK_OVERLAP"]
         )
 
+    def _chunker(self):
+        """Chunker por secciones para un documento (None = ventanas fijas de caracteres)"""
+        return StructuredChunker() if CONFIG["CHUNKING_ESTRUCTURAL"] else None
+
+    def _split(self, docs, chunker, final=True):
+        if chunker is None:
+            return self.text_splitter.split_documents(docs)
+        return chunker.feed(docs) + (chunker.flush() if final else [])
+
+    def _load_elements(self, file_path):
+        """Elementos de unstructured del PDF con los metadatos ya preparados"""
+        # unstructured sólo se carga cuando de verdad hay que parsear
+        UnstructuredPDFLoader = lazy_import("langchain_community.document_loaders.pdf").UnstructuredPDFLoader
+        loader = UnstructuredPDFLoader(file_path, mode="elements", strategy="fast")
+        return self._prepare(loader.load(), file_path)
+
+    def _prepare(self, docs, file_path):
+        """Filtra metadatos complejos y añade los metadatos simples"""
+        filtered_docs = filter_complex_metadata(docs)
+        for doc in filtered_docs:
+            doc.metadata.update({
+                "procesado_el": datetime.now().isoformat(),
+                "origen": file_path,
+                "archivo": os.path.basename(file_path)
+            })
+        return filtered_docs
+
+    @staticmethod
+    def _record_chunks(chunks):
+        informe = chunk_report(chunks)
+        metrics.contar("chunks_total", informe["chunks"])
+        metrics.contar("chunks_bytes_total", informe["bytes"])
+
     def load_and_split(self, file_path):
         """Carga y divide un documento PDF"""
         if not os.path.exists(file_path):
@@ -22,22 +65,115 @@ class DocumentProcessor:
             return None
 
         try:
-            loader = UnstructuredPDFLoader(file_path, mode="elements", strategy="fast")
-            docs = loader.load()
-            
-            # Filtrar metadatos complejos
-            filtered_docs = filter_complex_metadata(docs)
-            
-            # Añadir metadatos simples
-            for doc in filtered_docs:
-                doc.metadata.update({
-                    "procesado_el": datetime.now().isoformat(),
-                    "origen": file_path
-                })
-            
-            chunks = self.text_splitter.split_documents(filtered_docs)
+            with metrics.medir("parseo", modo="completo"):
+                chunks = self._split(self._load_elements(file_path), self._chunker())
+            self._record_chunks(chunks)
             logger.info(f"Documento dividido en {len(chunks)} chunks")
             return chunks
         except Exception as e:
             logger.error(f"Error procesando documento: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def iter_chunks(self, file_path):
+        """Genera los chunks de un PDF ventana a ventana de páginas.
+
+        Cada ventana de ``PAGINAS_POR_VENTANA`` páginas se extrae a un PDF en
+        memoria, se parsea y se divide antes de pasar a la siguiente, de modo
+        que la memoria queda acotada por la ventana y no por el documento.
+        Los errores se propagan al consumidor.
+        """
+        if not os.path.exists(file_path):
+            logger.error(f"Archivo no encontrado: {file_path}")
+            return
+
+        pikepdf = lazy_import("pikepdf")
+        partition_pdf = lazy_import("unstructured.partition.pdf").partition_pdf
+
+        ventana = CONFIG["PAGINAS_POR_VENTANA"]
+        chunker = self._chunker()
+        total = 0
+        with pikepdf.open(file_path) as pdf:
+            num_paginas = len(pdf.pages)
+            for inicio in range(0, num_paginas, ventana):
+                fin = min(inicio + ventana, num_paginas)
+                buffer = io.BytesIO()
+                with pikepdf.new() as parcial:
+                    parcial.pages.extend(pdf.pages[inicio:fin])
+                    parcial.save(buffer)
+                buffer.seek(0)
+
+                with metrics.medir("parseo", modo="ventana"):
+                    elements = partition_pdf(file=buffer, strategy="fast")
+                    docs = []
+                    for element in elements:
+                        metadata = {"source": file_path}
+                        metadata.update(element.metadata.to_dict())
+                        metadata["category"] = element.category
+                        # Numeración de página relativa al documento completo
+                        metadata["page_number"] = inicio + (element.metadata.page_number or 1)
+                        docs.append(Document(page_content=str(element), metadata=metadata))
+                    # La última sección queda abierta hasta la ventana siguiente
+                    chunks = self._split(self._prepare(docs, file_path), chunker, final=fin == num_paginas)
+
+                self._record_chunks(chunks)
+                for chunk in chunks:
+                    total += 1
+                    yield chunk
+
+        logger.info(f"Documento dividido en {total} chunks ({num_paginas} páginas)")
+
+    def compare_splitters(self, file_path):
+        """Chunks y bytes del troceado por secciones frente a las ventanas fijas"""
+        elementos = self._load_elements(file_path)
+        chunker = StructuredChunker()
+        ventanas = chunk_report(self.text_splitter.split_documents(elementos))
+        estructural = chunk_report(chunker.split(elementos))
+        informe = {
+            "ventanas": ventanas,
+            "estructural": estructural,
+            "elementos_descartados": chunker.descartados,
+            "reduccion_chunks": round(1 - estructural["chunks"] / ventanas["chunks"], 3) if ventanas["chunks"] else 0.0,
+            "reduccion_bytes": round(1 - estructural["bytes"] / ventanas["bytes"], 3) if ventanas["bytes"] else 0.0
+        }
+        logger.info(
+            f"Troceado de {os.path.basename(file_path)}: {ventanas['chunks']} → {estructural['chunks']} chunks, "
+            f"{ventanas['bytes']} → {estructural['bytes']} bytes"
+        )
+        return informe
+
+    @staticmethod
+    def expand_paths(paths):
+        """Expande archivos y directorios a la lista ordenada de PDF a procesar"""
+        archivos = []
+        for path in paths:
+            if os.path.isdir(path):
+                for raiz, _, nombres in os.walk(path):
+                    archivos.extend(
+                        os.path.join(raiz, nombre) for nombre in nombres
+                        if nombre.lower().endswith(".pdf")
+                    )
+            elif os.path.exists(path):
+                archivos.append(path)
+            else:
+                logger.error(f"Archivo no encontrado: {path}")
+        return sorted(dict.fromkeys(archivos))
+
+    @staticmethod
+    def load_many(file_paths, workers=None):
+        """Parsea varios PDF en un pool de procesos.
+
+        Genera pares (ruta, chunks) según terminan; ``chunks`` es None si el
+        archivo falló, igual que en ``load_and_split``. Los procesos se crean
+        con ``spawn``: quien llama suele tener ya hilos activos (precarga de
+        modelos, generación) y hacer fork con hilos puede dejar bloqueos copiados.
+        """
+        workers = min(workers or CONFIG["INGESTA_WORKERS"], len(file_paths))
+        if workers <= 1:
+            for file_path in file_paths:
+                yield _load_file(file_path)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futuros = [pool.submit(_load_file, path) for path in file_paths]
+            for futuro in as_completed(futuros):
+                yield futuro.result()
@@ -0,0 +1,87 @@
+import logging
+import os
+from cache import hash_texto
+from config import CONFIG
+from document_processor import DocumentProcessor
+from vector_db import VectorDatabase
+
+logger = logging.getLogger(__name__)
+
+
+def corpus_name(origenes):
+    """Nombre determinista de la colección que agrupa varios documentos.
+
+    Depende de la procedencia (rutas absolutas de entrada, o los orígenes
+    explícitos, que en la app incluyen el hash del contenido), no sólo de
+    los nombres: al editar un archivo se reindexa en la misma colección y
+    su versión anterior se purga, en lugar de crear un corpus nuevo cada vez.
+    """
+    return f"corpus_{hash_texto(*sorted(set(origenes)))[:16]}"
+
+
+def default_collection(doc_hashes, origenes):
+    """Colección por defecto: la del documento si es uno solo, o la del corpus"""
+    if len(doc_hashes) == 1:
+        return VectorDatabase.collection_name(doc_hashes[0])
+    return corpus_name(origenes)
+
+
+def _with_source(chunks, origen):
+    """Chunks con la procedencia ``origen`` en lugar de la ruta del archivo leído"""
+    for chunk in chunks:
+        chunk.metadata.update({"source": origen, "origen": origen, "archivo": os.path.basename(origen)})
+        yield chunk
+
+
+def ingest_files(paths, collection=None, workers=None, sources=None):
+    """Indexa uno o varios PDF (o directorios) en una misma colección.
+
+    Los documentos ya indexados en la colección se omiten; el resto se
+    parsea en un pool de procesos y cada uno se indexa en cuanto termina,
+    conservando su procedencia (``origen``, ``archivo``, ``doc_hash``) en
+    los metadatos. ``sources`` asigna a cada archivo el origen con el que
+    se registra en lugar de la ruta del temporal leído; un origen ya
+    registrado con otro contenido se purga, así que debe identificar al
+    documento y a su dueño. Devuelve la colección o None si no se pudo
+    indexar nada.
+    """
+    file_paths = DocumentProcessor.expand_paths(paths)
+    if not file_paths:
+        logger.error("No se encontraron documentos PDF para procesar")
+        return None
+
+    db = VectorDatabase()
+    hashes = {path: db.file_hash(path) for path in file_paths}
+    sources = sources or {}
+    if collection is None:
+        origenes = [sources[p] for p in file_paths] if sources else [os.path.abspath(p) for p in paths]
+        collection = default_collection(list(hashes.values()), origenes)
+
+    pendientes = [path for path in file_paths if not db.is_indexed(hashes[path], collection)]
+    logger.info(
+        f"Colección {collection}: {len(file_paths) - len(pendientes)} documentos ya indexados, "
+        f"{len(pendientes)} por procesar"
+    )
+
+    if len(pendientes) == 1:
+        # Un único documento: se indexa en streaming sin levantar procesos
+        path = pendientes[0]
+        origen = sources.get(path) or os.path.abspath(path)
+        db.index_document(
+            _with_source(DocumentProcessor().iter_chunks(path), origen), hashes[path], origen, collection,
+            sync_lexical=False
+        )
+    elif pendientes:
+        workers = workers or CONFIG["INGESTA_WORKERS"]
+        for path, chunks in DocumentProcessor.load_many(pendientes, workers):
+            if not chunks:
+                logger.error(f"Se omite {path}: no se pudo procesar")
+                continue
+            origen = sources.get(path) or os.path.abspath(path)
+            db.index_document(_with_source(chunks, origen), hashes[path], origen, collection, sync_lexical=False)
+
+    if pendientes:
+        # El índice BM25 se reescribe entero: una sola vez tras todos los documentos
+        db.sync_lexical_index(collection)
+
+    return db.load_collection(collection)
@@ -0,0 +1,218 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from config import CONFIG
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_FINALES = ("completado", "error", "cancelado")
+
+
+class _Job:
+    """Estado de un trabajo de la cola"""
+
+    def __init__(self, clave, tarea, prioridad):
+        self.id = uuid.uuid4().hex[:12]
+        self.clave = clave
+        self.tarea = tarea
+        self.prioridad = prioridad
+        self.estado = "pendiente"
+        self.eventos = []
+        self.resultado = None
+        self.error = None
+        # Peticiones que esperan este trabajo (las idénticas se unen a él)
+        self.suscriptores = 1
+        self.cancelado = threading.Event()
+        self.terminado = threading.Event()
+        self.creado = time.time()
+        self.inicio = None
+        self.fin = None
+
+
+class JobQueue:
+    """Cola local de trabajos de generación con prioridad y coalescencia.
+
+    Un pool fijo de ``workers`` hilos (dimensionado a lo que Ollama puede
+    atender a la vez) ejecuta los trabajos por prioridad y orden de
+    llegada. Una petición con la misma ``clave`` que un trabajo pendiente
+    o en curso no se encola: recibe el ID de ese trabajo (single-flight),
+    así que N peticiones idénticas cuestan una sola generación.
+
+    Una tarea devuelve su resultado o un generador de eventos
+    ``(evento, valor)`` como ``stream_quiz``; en ese caso los eventos se
+    pueden consultar mientras se ejecuta y el resultado es el valor del
+    último.
+    """
+
+    def __init__(self, workers=None, retencion=None):
+        self.workers = workers or CONFIG["COLA_WORKERS"]
+        self.retencion = retencion or CONFIG["COLA_RETENCION"]
+        self._cond = threading.Condition()
+        self._heap = []
+        self._orden = itertools.count()
+        self._trabajos = {}   # id -> _Job (también los terminados, durante ``retencion``)
+        self._en_vuelo = {}   # clave -> _Job pendiente o en curso
+
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"cola-{i}", daemon=True).start()
+
+    def submit(self, clave, tarea, prioridad=0):
+        """Encola ``tarea`` (sin argumentos) y devuelve el ID del trabajo.
+
+        Si ya hay un trabajo con la misma ``clave`` pendiente o en curso se
+        devuelve su ID; si la nueva petición tiene más prioridad, el trabajo
+        pendiente la hereda.
+        """
+        with self._cond:
+            self._purge()
+            job = self._en_vuelo.get(clave)
+            if job is not None:
+                job.suscriptores += 1
+                if prioridad > job.prioridad and job.estado == "pendiente":
+                    # La entrada anterior del heap queda obsoleta y se ignora al sacarla
+                    job.prioridad = prioridad
+                    heapq.heappush(self._heap, (-prioridad, next(self._orden), job))
+                metrics.contar("cola_coalescidos_total")
+                logger.info(f"Petición unida al trabajo {job.id} ({job.suscriptores} suscriptores)")
+                return job.id
+
+            job = _Job(clave, tarea, prioridad)
+            self._trabajos[job.id] = job
+            self._en_vuelo[clave] = job
+            heapq.heappush(self._heap, (-prioridad, next(self._orden), job))
+            self._gauges()
+            self._cond.notify()
+        metrics.contar("cola_trabajos_encolados_total")
+        return job.id
+
+    def cancel(self, job_id):
+        """Retira una suscripción; el trabajo se cancela cuando nadie más lo espera.
+
+        Un trabajo pendiente sale de la cola; uno en curso se detiene en el
+        siguiente evento (las llamadas al LLM ya lanzadas terminan). Devuelve
+        True si el trabajo quedó cancelado.
+        """
+        with self._cond:
+            job = self._trabajos.get(job_id)
+            if job is None or job.estado in ESTADOS_FINALES:
+                return False
+            job.suscriptores -= 1
+            if job.suscriptores > 0:
+                return False
+
+            job.cancelado.set()
+            # Las nuevas peticiones iguales no deben unirse a un trabajo cancelado
+            if self._en_vuelo.get(job.clave) is job:
+                del self._en_vuelo[job.clave]
+            if job.estado == "pendiente":
+                self._finish(job, "cancelado")
+            self._gauges()
+        logger.info(f"Trabajo {job_id} cancelado")
+        return True
+
+    def status(self, job_id):
+        """Estado de un trabajo (None si no existe o ya se purgó)"""
+        with self._cond:
+            job = self._trabajos.get(job_id)
+            if job is None:
+                return None
+            estado = {
+                "id": job.id,
+                "estado": job.estado,
+                "prioridad": job.prioridad,
+                "suscriptores": job.suscriptores,
+                "eventos": len(job.eventos),
+                "espera_s": round((job.inicio or job.fin or time.time()) - job.creado, 3)
+            }
+            if job.estado == "pendiente":
+                estado["posicion"] = self._position(job)
+            if job.inicio and job.fin:
+                estado["duracion_s"] = round(job.fin - job.inicio, 3)
+            if job.estado == "completado":
+                estado["resultado"] = job.resultado
+            if job.error:
+                estado["error"] = job.error
+            return estado
+
+    def events(self, job_id, desde=0):
+        """Eventos emitidos por el trabajo a partir del índice ``desde``"""
+        with self._cond:
+            job = self._trabajos.get(job_id)
+            return list(job.eventos[desde:]) if job else []
+
+    def result(self, job_id, timeout=None):
+        """Espera a que el trabajo termine y devuelve su resultado (None si no terminó bien)"""
+        with self._cond:
+            job = self._trabajos.get(job_id)
+        if job is None or not job.terminado.wait(timeout):
+            return None
+        return job.resultado if job.estado == "completado" else None
+
+    def _position(self, job):
+        """Trabajos pendientes que se ejecutarán antes que ``job``"""
+        pendientes = {otro.id: otro for _, _, otro in self._heap if otro.estado == "pendiente"}
+        orden = sorted(pendientes.values(), key=lambda otro: (-otro.prioridad, otro.creado))
+        return orden.index(job)
+
+    def _gauges(self):
+        estados = [job.estado for job in self._en_vuelo.values()]
+        metrics.fijar("cola_pendientes", estados.count("pendiente"))
+        metrics.fijar("cola_en_curso", estados.count("en_curso"))
+
+    def _purge(self):
+        """Olvida los trabajos terminados hace más de ``retencion`` segundos"""
+        limite = time.time() - self.retencion
+        for job_id in [i for i, job in self._trabajos.items() if job.fin and job.fin < limite]:
+            del self._trabajos[job_id]
+
+    def _finish(self, job, estado):
+        job.estado = estado
+        job.fin = time.time()
+        job.tarea = None
+        if self._en_vuelo.get(job.clave) is job:
+            del self._en_vuelo[job.clave]
+        job.terminado.set()
+        metrics.contar("cola_trabajos_total", estado=estado)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                if job.estado != "pendiente":
+                    continue
+                job.estado = "en_curso"
+                job.inicio = time.time()
+                self._gauges()
+            metrics.observar("cola_espera_segundos", job.inicio - job.creado)
+            self._run(job)
+
+    def _run(self, job):
+        try:
+            with metrics.medir("cola_trabajo"):
+                resultado = job.tarea()
+                if hasattr(resultado, "__next__"):
+                    eventos, resultado = resultado, None
+                    for evento in eventos:
+                        if job.cancelado.is_set():
+                            eventos.close()
+                            break
+                        with self._cond:
+                            job.eventos.append(evento)
+                        resultado = evento[1]
+            estado = "cancelado" if job.cancelado.is_set() else "completado"
+            job.resultado = resultado
+        except Exception as e:
+            logger.error(f"Error en el trabajo {job.id}: {str(e)}", exc_info=True)
+            job.error = str(e)
+            estado = "error"
+
+        with self._cond:
+            self._finish(job, estado)
+            self._gauges()
+        logger.info(f"Trabajo {job.id} {estado} en {job.fin - job.inicio:.1f}s")
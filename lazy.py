@@ -0,0 +1,37 @@
+import sys
+import time
+import logging
+import importlib
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Segundos que tardó cada importación diferida (la primera vez)
+_tiempos = {}
+
+
+def lazy_import(nombre):
+    """Importa un módulo en su primer uso y registra cuánto tardó.
+
+    Las dependencias pesadas (unstructured, chromadb, LangChain...) se
+    cargan así sólo en los caminos que las necesitan, de modo que ``--help``
+    o generar desde un índice existente no pagan su coste de arranque.
+    """
+    modulo = sys.modules.get(nombre)
+    # Un módulo que otro hilo aún está importando ya figura en sys.modules;
+    # import_module espera a que termine en lugar de devolverlo a medias
+    if modulo is not None and not getattr(getattr(modulo, "__spec__", None), "_initializing", False):
+        return modulo
+
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nombre)
+    duracion = time.perf_counter() - inicio
+    _tiempos.setdefault(nombre, duracion)
+    metrics.observar("importacion_segundos", duracion, modulo=nombre)
+    logger.debug(f"Módulo {nombre} importado en {duracion:.2f}s")
+    return modulo
+
+
+def import_report():
+    """Pares (módulo, segundos) de las importaciones diferidas, de mayor a menor"""
+    return sorted(_tiempos.items(), key=lambda par: par[1], reverse=True)
@@ -0,0 +1,198 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+import numpy as np
+from langchain_core.documents import Document
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_PALABRAS = re.compile(r"\w+")
+
+# Palabras vacías frecuentes en español (no aportan a la puntuación BM25)
+STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante
+e el ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue
+fueron ha han hay la las le les lo los mas me mi muy ni no nos o os otra otro para pero poco
+por porque que se ser si sin sobre son su sus tambien te tiene tienen todo todos tu un una
+unas uno unos y ya
+""".split())
+
+# Índices abiertos en el proceso, por ruta (se recargan si cambia el archivo)
+_lock = threading.Lock()
+_abiertos = {}
+
+
+def tokenize(texto):
+    """Términos en minúsculas y sin tildes; conserva cifras y fórmulas (h2o, 1492)"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in _PALABRAS.findall(texto) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def index_path(vectorstore):
+    """Ruta del índice BM25 de una colección Chroma: junto a ella, en su directorio"""
+    directorio = getattr(vectorstore, "_persist_directory", None)
+    if not directorio:
+        return None
+    return os.path.join(directorio, "bm25", f"{vectorstore._collection.name}.json")
+
+
+class BM25Index:
+    """Índice invertido BM25 persistido en JSON junto a la colección Chroma.
+
+    Guarda por chunk su ID de Chroma, texto, metadatos y frecuencias de
+    términos, de modo que una búsqueda léxica no necesita ni embeddings
+    ni abrir la colección. Las listas de apariciones se construyen en
+    memoria al cargar y la puntuación se calcula con NumPy.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.ids, self.textos, self.metadatos, self.frecuencias = [], [], [], []
+        self._postings = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                datos = json.load(f)
+            self.ids = datos["ids"]
+            self.textos = datos["textos"]
+            self.metadatos = datos["metadatos"]
+            self.frecuencias = datos["frecuencias"]
+        self._postings = None
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "ids": self.ids, "textos": self.textos,
+                "metadatos": self.metadatos, "frecuencias": self.frecuencias
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def sync(self, collection):
+        """Alinea el índice con los chunks de la colección Chroma.
+
+        Sólo se tokenizan los chunks nuevos; los que ya no están en la
+        colección se eliminan. Devuelve (añadidos, eliminados).
+        """
+        actuales = set(collection.get(include=[])["ids"])
+        conservar = [i for i, id_ in enumerate(self.ids) if id_ in actuales]
+        eliminados = len(self.ids) - len(conservar)
+        if eliminados:
+            self.ids = [self.ids[i] for i in conservar]
+            self.textos = [self.textos[i] for i in conservar]
+            self.metadatos = [self.metadatos[i] for i in conservar]
+            self.frecuencias = [self.frecuencias[i] for i in conservar]
+
+        nuevos = sorted(actuales - set(self.ids))
+        if nuevos:
+            res = collection.get(ids=nuevos, include=["documents", "metadatas"])
+            for id_, texto, metadatos in zip(res["ids"], res["documents"], res["metadatas"]):
+                self.ids.append(id_)
+                self.textos.append(texto or "")
+                self.metadatos.append(metadatos or {})
+                self.frecuencias.append(dict(Counter(tokenize(texto or ""))))
+
+        if nuevos or eliminados or not os.path.exists(self.path):
+            self.save()
+            self._postings = None
+            logger.info(f"Índice BM25 {os.path.basename(self.path)}: {len(nuevos)} chunks añadidos, {eliminados} eliminados")
+        return len(nuevos), eliminados
+
+    def _build(self):
+        apariciones = defaultdict(lambda: ([], []))
+        longitudes = np.zeros(len(self.ids))
+        for i, frecuencias in enumerate(self.frecuencias):
+            longitudes[i] = sum(frecuencias.values())
+            for termino, n in frecuencias.items():
+                apariciones[termino][0].append(i)
+                apariciones[termino][1].append(n)
+
+        self._postings = {
+            termino: (np.array(indices), np.array(n, dtype=float))
+            for termino, (indices, n) in apariciones.items()
+        }
+        self._longitudes = longitudes
+        self._media = longitudes.mean() if len(longitudes) else 0.0
+
+    def search(self, consulta, k):
+        """Los ``k`` chunks con mayor puntuación BM25: lista de (id, puntuación)"""
+        if not self.ids:
+            return []
+        if self._postings is None:
+            self._build()
+
+        total = len(self.ids)
+        puntuacion = np.zeros(total)
+        for termino in set(tokenize(consulta)):
+            if termino not in self._postings:
+                continue
+            indices, tf = self._postings[termino]
+            idf = math.log(1 + (total - len(indices) + 0.5) / (len(indices) + 0.5))
+            norma = self.k1 * (1 - self.b + self.b * self._longitudes[indices] / (self._media or 1))
+            puntuacion[indices] += idf * tf * (self.k1 + 1) / (tf + norma)
+
+        k = min(k, int((puntuacion > 0).sum()))
+        if not k:
+            return []
+        mejores = np.argpartition(-puntuacion, k - 1)[:k]
+        mejores = mejores[np.argsort(-puntuacion[mejores])]
+        metrics.contar("busquedas_lexicas_total")
+        return [(self.ids[i], float(puntuacion[i])) for i in mejores]
+
+    def documents(self, ids):
+        """Document de cada ID (en el mismo orden) a partir de los textos guardados"""
+        posicion = {id_: i for i, id_ in enumerate(self.ids)}
+        return [
+            Document(id=id_, page_content=self.textos[posicion[id_]], metadata=self.metadatos[posicion[id_]])
+            for id_ in ids if id_ in posicion
+        ]
+
+
+def open_index(vectorstore, sync=False):
+    """Índice BM25 compartido de una colección Chroma, creándolo si aún no existe.
+
+    Con ``sync`` (tras indexar) se actualiza contra la colección; un índice
+    que no existe en disco (colecciones anteriores) también se construye.
+    """
+    path = index_path(vectorstore)
+    if path is None:
+        return None
+
+    with _lock:
+        if sync or not os.path.exists(path):
+            # Se actualiza una copia: las búsquedas en curso siguen con la anterior
+            indice = BM25Index(path).load()
+            indice.sync(vectorstore._collection)
+        else:
+            abierto = _abiertos.get(path)
+            if abierto is not None and abierto[0] == os.path.getmtime(path):
+                return abierto[1]
+            indice = BM25Index(path).load()
+        _abiertos[path] = (os.path.getmtime(path), indice)
+    return indice
+
+
+def remove_index(vectorstore):
+    """Borra el índice BM25 de una colección eliminada"""
+    path = index_path(vectorstore)
+    if path is None:
+        return
+    with _lock:
+        _abiertos.pop(path, None)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,76 @@
+import atexit
+import logging
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import CONFIG
+from lazy import lazy_import
+
+logger = logging.getLogger(__name__)
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """Embeddings calculados en el propio proceso con sentence-transformers.
+
+    Evita el viaje HTTP a Ollama: los textos se codifican en lotes grandes
+    en CPU (o en varios procesos si ``procesos`` > 1) y los vectores se
+    normalizan con NumPy. El modelo se carga en el primer uso.
+    """
+
+    def __init__(self, model_name=None, batch_size=None, procesos=None, device=None):
+        self.model_name = model_name or CONFIG["MODELO_EMBEDDINGS_LOCAL"]
+        self.batch_size = batch_size or CONFIG["EMBEDDINGS_LOCAL_BATCH"]
+        self.procesos = procesos or CONFIG["EMBEDDINGS_LOCAL_PROCESOS"]
+        self.device = device or CONFIG["EMBEDDINGS_LOCAL_DISPOSITIVO"]
+        self._lock = threading.Lock()
+        # Todas las llamadas comparten las colas del pool y numeran sus trozos
+        # desde 0: dos a la vez se quedarían con los vectores de la otra
+        self._pool_lock = threading.Lock()
+        self._model = None
+        self._pool = None
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                sentence_transformers = lazy_import("sentence_transformers")
+                self._model = sentence_transformers.SentenceTransformer(self.model_name, device=self.device)
+                logger.info(f"Modelo de embeddings local cargado: {self.model_name} ({self.device})")
+            return self._model
+
+    def _get_pool(self, model):
+        with self._lock:
+            if self._pool is None:
+                self._pool = model.start_multi_process_pool([self.device] * self.procesos)
+                atexit.register(self.close)
+            return self._pool
+
+    def close(self):
+        """Detiene el pool de procesos de codificación, si se creó"""
+        with self._lock:
+            if self._pool is not None:
+                lazy_import("sentence_transformers").SentenceTransformer.stop_multi_process_pool(self._pool)
+                self._pool = None
+
+    def _encode(self, texts):
+        if not texts:
+            return []
+        model = self._get_model()
+        # El pool de procesos sólo compensa si cada proceso recibe al menos un lote (ingesta)
+        if self.procesos > 1 and len(texts) >= self.procesos * self.batch_size:
+            pool = self._get_pool(model)
+            with self._pool_lock:
+                vectores = model.encode_multi_process(texts, pool, batch_size=self.batch_size)
+        else:
+            vectores = model.encode(
+                texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False
+            )
+
+        vectores = np.asarray(vectores, dtype=np.float32)
+        normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+        return (vectores / np.maximum(normas, 1e-12)).tolist()
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts))
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
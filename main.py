@@ -1,9 +1,14 @@
 import logging
-from document_processor import DocumentProcessor
-from vector_db import VectorDatabase
-from quiz_generator import QuizGenerator
+from config import CONFIG
+from lazy import import_report, lazy_import
+from metrics import metrics
 import argparse
 import json
+import threading
+import time
+
+# Instante de arranque, para el informe de importaciones
+INICIO = time.perf_counter()
 
 # Configuración de logging
 logging.basicConfig(
@@ -13,35 +18,61 @@ logging.basicConfig(
 
 def main():
     parser = argparse.ArgumentParser(description="Generador de Cuestionarios Educativos")
-    parser.add_argument("file", help="Ruta al archivo PDF educativo")
+    parser.add_argument("archivos", nargs="*", help="Archivos PDF o directorios con PDF educativos")
     parser.add_argument("-n", "--num_preguntas", type=int, default=5, help="Número de preguntas a generar")
     parser.add_argument("-t", "--tema", help="Tema principal (opcional)")
+    parser.add_argument("-c", "--coleccion", help="Colección donde indexar los documentos; sin archivos, se usa la colección ya indexada")
+    parser.add_argument("-w", "--workers", type=int, help="Procesos para parsear varios PDF en paralelo")
+    parser.add_argument("--nuevo", action="store_true", help="Ignorar la caché y generar un cuestionario nuevo")
+    parser.add_argument("--metricas", help="Guardar las métricas (formato Prometheus) en este archivo")
+    parser.add_argument("--perfil", help="Guardar un perfil cProfile de la generación en este directorio")
+    parser.add_argument("--importaciones", action="store_true", help="Mostrar cuánto tardó en cargarse cada dependencia")
     args = parser.parse_args()
-    
-    # Paso 1: Procesar documento
-    processor = DocumentProcessor()
-    chunks = processor.load_and_split(args.file)
-    if not chunks:
-        return
-    
-    # Paso 2: Crear base de datos vectorial
-    db = VectorDatabase()
-    vector_db = db.create_db(chunks, "cuestionario_db")
+    if not args.archivos and not args.coleccion:
+        parser.error("indica archivos PDF o una colección ya indexada con -c")
+
+    if args.perfil:
+        CONFIG["PERFIL_DIR"] = args.perfil
+
+    # Precarga de los modelos en Ollama mientras se procesan los documentos
+    clients = lazy_import("clients")
+    threading.Thread(target=clients.warm_up, daemon=True).start()
+
+    # Paso 1 y 2: Procesar e indexar los documentos (los ya indexados se omiten).
+    # Con sólo -c se abre el índice existente sin cargar el parser de PDF.
+    if args.archivos:
+        vector_db = lazy_import("ingest").ingest_files(args.archivos, args.coleccion, args.workers)
+    else:
+        vector_db = lazy_import("vector_db").VectorDatabase().load_collection(args.coleccion)
     if not vector_db:
+        print("\n❌ Error: No se pudo indexar ningún documento")
         return
     
     # Paso 3: Configurar generador
     retriever = vector_db.as_retriever(search_kwargs={"k": 5})
-    generator = QuizGenerator(retriever)
+    QuizGenerator = lazy_import("quiz_generator").QuizGenerator
+    generator = QuizGenerator(retriever, cache=clients.get_quiz_cache())
     
     # Paso 4: Generar cuestionario
     tema = args.tema if args.tema else "contenido educativo del documento"
+    arranque = time.perf_counter() - INICIO
     quiz = generator.generate_quiz(
         topic=tema,
         num_questions=args.num_preguntas,
-        percentages=(40, 40, 20)
+        percentages=(40, 40, 20),
+        fresh=args.nuevo
     )
     
+    if args.importaciones:
+        print(f"\n⏱️ Arranque (importaciones e índice) antes de generar: {arranque:.2f}s")
+        for modulo, segundos in import_report():
+            print(f"   {segundos:6.2f}s  {modulo}")
+
+    if args.metricas:
+        with open(args.metricas, "w", encoding="utf-8") as f:
+            f.write(metrics.exportar_prometheus())
+        print(f"📈 Métricas guardadas en '{args.metricas}'")
+
     if quiz is None:
         print("\n❌ Error: No se generó ningún cuestionario (respuesta None)")
         return
@@ -0,0 +1,182 @@
+import os
+import time
+import uuid
+import bisect
+import cProfile
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Límites (en segundos) de los histogramas de latencia
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Identificador de la petición en curso, propagado a los eventos
+_solicitud = contextvars.ContextVar("solicitud", default=None)
+
+
+class Metrics:
+    """Registro de métricas con hooks y exportación en formato Prometheus.
+
+    Cada medición se acumula en contadores/histogramas y además se notifica
+    como evento (dict) a los hooks registrados, con el id de la petición en
+    curso para poder agrupar las métricas por petición.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._gauges = {}
+        self._histogramas = {}
+        self._hooks = []
+
+    def add_hook(self, hook):
+        """Registra un callable que recibe cada evento de métrica"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _emitir(self, tipo, nombre, valor, etiquetas):
+        evento = {
+            "tipo": tipo,
+            "nombre": nombre,
+            "valor": valor,
+            "etiquetas": etiquetas,
+            "solicitud": _solicitud.get(),
+            "momento": time.time()
+        }
+        for hook in list(self._hooks):
+            try:
+                hook(evento)
+            except Exception as e:
+                logger.warning(f"Error en hook de métricas: {str(e)}")
+
+    def contar(self, nombre, valor=1, **etiquetas):
+        """Incrementa un contador"""
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+        self._emitir("contador", nombre, valor, etiquetas)
+
+    def fijar(self, nombre, valor, **etiquetas):
+        """Fija el valor actual de un gauge"""
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._gauges[clave] = valor
+        self._emitir("gauge", nombre, valor, etiquetas)
+
+    def observar(self, nombre, valor, **etiquetas):
+        """Registra una observación en un histograma"""
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.setdefault(
+                clave, {"buckets": [0] * len(BUCKETS), "suma": 0.0, "total": 0}
+            )
+            indice = bisect.bisect_left(BUCKETS, valor)
+            if indice < len(BUCKETS):
+                histograma["buckets"][indice] += 1
+            histograma["suma"] += valor
+            histograma["total"] += 1
+        self._emitir("histograma", nombre, valor, etiquetas)
+
+    @contextmanager
+    def medir(self, nombre, **etiquetas):
+        """Mide la duración del bloque en ``<nombre>_segundos``"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(f"{nombre}_segundos", time.perf_counter() - inicio, **etiquetas)
+
+    @contextmanager
+    def solicitud(self):
+        """Asocia los eventos del bloque a un id de petición (reutiliza el actual si existe)"""
+        if _solicitud.get() is not None:
+            yield _solicitud.get()
+            return
+        token = _solicitud.set(uuid.uuid4().hex[:12])
+        try:
+            yield _solicitud.get()
+        finally:
+            _solicitud.reset(token)
+
+    def snapshot(self):
+        """Copia de los valores acumulados"""
+        with self._lock:
+            return {
+                "contadores": {self._nombre(n, e): v for (n, e), v in self._contadores.items()},
+                "gauges": {self._nombre(n, e): v for (n, e), v in self._gauges.items()},
+                "histogramas": {
+                    self._nombre(n, e): {"suma": h["suma"], "total": h["total"]}
+                    for (n, e), h in self._histogramas.items()
+                }
+            }
+
+    @staticmethod
+    def _nombre(nombre, etiquetas, extra=()):
+        pares = list(etiquetas) + list(extra)
+        if not pares:
+            return nombre
+        return nombre + "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+    def exportar_prometheus(self, prefijo="eduquizgen"):
+        """Exporta las métricas en el formato de texto de Prometheus"""
+        lineas = []
+        with self._lock:
+            for nombre in sorted({n for n, _ in self._contadores}):
+                lineas.append(f"# TYPE {prefijo}_{nombre} counter")
+                for (n, etiquetas), valor in sorted(self._contadores.items()):
+                    if n == nombre:
+                        lineas.append(f"{self._nombre(f'{prefijo}_{n}', etiquetas)} {valor}")
+
+            for nombre in sorted({n for n, _ in self._gauges}):
+                lineas.append(f"# TYPE {prefijo}_{nombre} gauge")
+                for (n, etiquetas), valor in sorted(self._gauges.items()):
+                    if n == nombre:
+                        lineas.append(f"{self._nombre(f'{prefijo}_{n}', etiquetas)} {valor}")
+
+            for nombre in sorted({n for n, _ in self._histogramas}):
+                lineas.append(f"# TYPE {prefijo}_{nombre} histogram")
+                for (n, etiquetas), h in sorted(self._histogramas.items()):
+                    if n != nombre:
+                        continue
+                    acumulado = 0
+                    for limite, cuenta in zip(BUCKETS, h["buckets"]):
+                        acumulado += cuenta
+                        lineas.append(
+                            f"{self._nombre(f'{prefijo}_{n}_bucket', etiquetas, [('le', limite)])} {acumulado}"
+                        )
+                    lineas.append(
+                        f"{self._nombre(f'{prefijo}_{n}_bucket', etiquetas, [('le', '+Inf')])} {h['total']}"
+                    )
+                    lineas.append(f"{self._nombre(f'{prefijo}_{n}_sum', etiquetas)} {h['suma']}")
+                    lineas.append(f"{self._nombre(f'{prefijo}_{n}_count', etiquetas)} {h['total']}")
+        return "\n".join(lineas) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def perfilar(nombre):
+    """Captura un perfil cProfile del bloque si CONFIG["PERFIL_DIR"] está definido"""
+    directorio = CONFIG["PERFIL_DIR"]
+    if not directorio:
+        yield
+        return
+
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        os.makedirs(directorio, exist_ok=True)
+        path = os.path.join(directorio, f"{nombre}-{datetime.now():%Y%m%d-%H%M%S-%f}.prof")
+        perfil.dump_stats(path)
+        logger.info(f"Perfil guardado en {path}")
@@ -0,0 +1,135 @@
+import io
+import logging
+from functools import lru_cache
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+logger = logging.getLogger(__name__)
+
+TITULO = "Cuestionario generado automáticamente"
+MARGEN = 50
+MARGEN_INFERIOR = 60
+
+# Variantes de exportación: con soluciones (profesor) o sin ellas (alumno)
+VARIANTES = ("profesor", "alumno")
+
+
+@lru_cache(maxsize=20000)
+def _word_width(palabra, fuente, tamano):
+    """Ancho de una palabra; las palabras se repiten mucho entre preguntas"""
+    return stringWidth(palabra, fuente, tamano)
+
+
+def wrap_text(texto, fuente, tamano, max_width):
+    """Parte el texto en líneas de como mucho ``max_width`` puntos.
+
+    El ancho de la línea se acumula palabra a palabra (ancho de la palabra
+    más el de un espacio), sin volver a medir la línea entera.
+    """
+    espacio = _word_width(" ", fuente, tamano)
+    lineas, actual, ancho = [], [], 0.0
+    for palabra in texto.split():
+        ancho_palabra = _word_width(palabra, fuente, tamano)
+        nuevo = ancho + espacio + ancho_palabra if actual else ancho_palabra
+        if actual and nuevo > max_width:
+            lineas.append(" ".join(actual))
+            actual, nuevo = [], ancho_palabra
+        actual.append(palabra)
+        ancho = nuevo
+    if actual:
+        lineas.append(" ".join(actual))
+    return lineas
+
+
+class _PageWriter:
+    """Escribe líneas en el canvas y salta de página cuando no caben"""
+
+    def __init__(self, c, pagesize):
+        self.c = c
+        self.width, self.height = pagesize
+        self.max_width = self.width - 2 * MARGEN
+        self.y = self.height - MARGEN
+
+    def new_page(self):
+        self.c.showPage()
+        self.y = self.height - MARGEN
+
+    def text(self, texto, x, fuente, tamano, interlineado):
+        for linea in wrap_text(texto, fuente, tamano, self.max_width - (x - MARGEN)):
+            if self.y < MARGEN_INFERIOR:
+                self.new_page()
+            # showPage reinicia el estado gráfico: la fuente se fija en cada línea
+            self.c.setFont(fuente, tamano)
+            self.c.drawString(x, self.y, linea)
+            self.y -= interlineado
+
+    def space(self, puntos):
+        self.y -= puntos
+
+
+def _draw_quiz(writer, quiz, variante, titulo):
+    writer.text(titulo, MARGEN, "Helvetica-Bold", 16, 20)
+    writer.space(20)
+
+    for i, pregunta in enumerate(quiz.get("cuestionario", []), 1):
+        writer.text(f"{i}. {pregunta.get('enunciado', '')}", MARGEN, "Helvetica-Bold", 12, 15)
+
+        if pregunta.get("tipo") == "opcion_multiple":
+            for j, opcion in enumerate(pregunta.get("opciones", [])):
+                writer.text(f"{chr(65+j)}. {opcion}", 70, "Helvetica", 11, 13)
+
+        if variante == "alumno":
+            if pregunta.get("tipo") == "pregunta_abierta":
+                for _ in range(3):
+                    writer.text("_" * 80, 70, "Helvetica", 11, 18)
+            elif pregunta.get("tipo") == "verdadero_falso":
+                writer.text("( ) Verdadero    ( ) Falso", 70, "Helvetica", 11, 13)
+            writer.space(10)
+            continue
+
+        if pregunta.get("tipo") == "pregunta_abierta":
+            writer.text("Respuesta: [Respuesta abierta]", 70, "Helvetica-Oblique", 11, 13)
+        else:
+            writer.text(f"Respuesta: {pregunta.get('respuesta_correcta', '')}", 70, "Helvetica-Oblique", 11, 13)
+
+        explicacion = pregunta.get("explicacion", "")
+        if explicacion:
+            writer.text(f"Explicación: {explicacion}", 70, "Helvetica", 10, 12)
+        writer.space(10)
+
+
+def export_many(quizzes, variantes=("profesor",), titulos=None, pagesize=letter):
+    """Exporta varios cuestionarios a un único PDF en memoria y devuelve sus bytes.
+
+    Cada cuestionario se imprime en cada una de las ``variantes`` pedidas,
+    empezando siempre en una página nueva (útil para imprimir juegos de
+    una clase: hoja del alumno seguida de la del profesor).
+    """
+    for variante in variantes:
+        if variante not in VARIANTES:
+            raise ValueError(f"Variante desconocida: {variante}")
+
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=pagesize)
+    writer = _PageWriter(c, pagesize)
+
+    primera = True
+    for n, quiz in enumerate(quizzes):
+        titulo = titulos[n] if titulos else TITULO
+        for variante in variantes:
+            if not primera:
+                writer.new_page()
+            primera = False
+            sufijo = " (solucionario)" if variante == "profesor" and len(variantes) > 1 else ""
+            _draw_quiz(writer, quiz, variante, titulo + sufijo)
+
+    paginas = c.getPageNumber()
+    c.save()
+    logger.info(f"PDF generado: {len(quizzes)} cuestionarios, {paginas} páginas")
+    return buffer.getvalue()
+
+
+def export_pdf(quiz, variante="profesor", titulo=TITULO):
+    """PDF (bytes) de un solo cuestionario"""
+    return export_many([quiz], (variante,), [titulo])
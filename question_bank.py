@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import random
+import sqlite3
+import threading
+import time
+import logging
+from array import array
+import numpy as np
+from config import CONFIG
+from cache import hash_texto
+from clients import get_embeddings, get_question_bank
+from lexical import tokenize
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def attribute_chunks(pregunta, docs, max_chunks=2):
+    """IDs de los chunks de ``docs`` que más términos comparten con la pregunta"""
+    terminos = set(tokenize(" ".join(
+        str(pregunta.get(campo, "")) for campo in ("enunciado", "respuesta_correcta", "explicacion")
+    )))
+    puntuados = []
+    for doc in docs:
+        comunes = len(terminos & set(tokenize(doc.page_content)))
+        if comunes and getattr(doc, "id", None):
+            puntuados.append((comunes, doc.id))
+    puntuados.sort(key=lambda x: -x[0])
+    return list(dict.fromkeys(chunk for _, chunk in puntuados))[:max_chunks]
+
+
+def bank_scope(vectorstore):
+    """Ámbito de las preguntas de una colección Chroma ("directorio/nombre").
+
+    El directorio distingue los backends de embeddings y las bases creadas
+    con ``create_db``, que comparten el nombre de colección por defecto.
+    """
+    coleccion = getattr(vectorstore, "_collection", None)
+    if coleccion is None:
+        return None
+    directorio = getattr(vectorstore, "_persist_directory", None) or ""
+    return f"{os.path.basename(os.path.normpath(directorio))}/{coleccion.name}"
+
+
+def forget_chunks(chunk_ids):
+    """Descarta del banco compartido las preguntas de chunks eliminados"""
+    if CONFIG["BANCO_PREGUNTAS"] and chunk_ids:
+        get_question_bank().discard_chunks(chunk_ids)
+
+
+def forget_collection(vectorstore):
+    """Descarta del banco compartido las preguntas de una colección eliminada"""
+    if CONFIG["BANCO_PREGUNTAS"]:
+        get_question_bank().discard_collection(bank_scope(vectorstore))
+
+
+class QuestionBank:
+    """Banco persistente de preguntas validadas en SQLite.
+
+    Cada pregunta se guarda con su colección, tipo, dificultad, el embedding
+    del tema para el que se generó y los IDs de los chunks de los que sale.
+    ``take`` sirve preguntas de un tema parecido (similitud coseno con
+    NumPy) dando prioridad a las menos usadas, sin llamar al LLM.
+    """
+
+    def __init__(self, path=None, umbral=None, embeddings=None):
+        self.path = path or CONFIG["BANCO_PATH"]
+        self.umbral = umbral or CONFIG["BANCO_UMBRAL_TEMA"]
+        self._embeddings = embeddings
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS preguntas ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " coleccion TEXT NOT NULL,"
+            " clave TEXT NOT NULL,"
+            " tipo TEXT NOT NULL,"
+            " dificultad TEXT NOT NULL,"
+            " tema TEXT NOT NULL,"
+            " tema_vector BLOB NOT NULL,"
+            " pregunta TEXT NOT NULL,"
+            " creado REAL NOT NULL,"
+            " usos INTEGER NOT NULL DEFAULT 0,"
+            " UNIQUE (coleccion, clave))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_coleccion_tipo ON preguntas (coleccion, tipo, dificultad)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pregunta_chunks ("
+            " pregunta_id INTEGER NOT NULL REFERENCES preguntas (id) ON DELETE CASCADE,"
+            " chunk_id TEXT NOT NULL,"
+            " PRIMARY KEY (pregunta_id, chunk_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk ON pregunta_chunks (chunk_id)")
+        self._conn.commit()
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = get_embeddings()
+        return self._embeddings
+
+    @staticmethod
+    def _clave(pregunta):
+        return hash_texto(re.sub(r"\W+", " ", str(pregunta.get("enunciado", ""))).strip().lower())
+
+    def add(self, coleccion, tema, preguntas):
+        """Guarda pares (pregunta, ids de chunks); las ya presentes se ignoran"""
+        if not preguntas:
+            return 0
+        vector = array("d", self.embeddings.embed_query(tema)).tobytes()
+
+        with self._lock:
+            ahora = time.time()
+            nuevas = 0
+            for pregunta, chunks in preguntas:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO preguntas (coleccion, clave, tipo, dificultad, tema, tema_vector, pregunta, creado)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (coleccion, self._clave(pregunta), pregunta.get("tipo", ""),
+                     pregunta.get("dificultad", "intermedio"), tema, vector,
+                     json.dumps(pregunta, ensure_ascii=False), ahora)
+                )
+                if cursor.rowcount:
+                    nuevas += 1
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO pregunta_chunks (pregunta_id, chunk_id) VALUES (?, ?)",
+                        [(cursor.lastrowid, chunk) for chunk in chunks]
+                    )
+            self._conn.commit()
+        metrics.contar("banco_preguntas_guardadas_total", nuevas)
+        return nuevas
+
+    def take(self, coleccion, tema, cuentas, dificultad=None):
+        """Preguntas del banco para el tema: como mucho ``cuentas[tipo]`` de cada tipo.
+
+        Sólo se consideran las generadas para un tema con similitud coseno
+        >= ``umbral``; entre ellas se eligen primero las menos servidas.
+        """
+        if not any(cuentas.values()):
+            return []
+        consulta = np.array(self.embeddings.embed_query(tema), dtype=float)
+        consulta /= np.linalg.norm(consulta) or 1
+
+        elegidas = []
+        with self._lock:
+            for tipo, cuenta in cuentas.items():
+                if cuenta <= 0:
+                    continue
+                sql = "SELECT id, tema_vector, pregunta, usos FROM preguntas WHERE coleccion = ? AND tipo = ?"
+                parametros = [coleccion, tipo]
+                if dificultad:
+                    sql += " AND dificultad = ?"
+                    parametros.append(dificultad)
+                filas = self._conn.execute(sql, parametros).fetchall()
+
+                # Vectores de otro modelo de embeddings (otra dimensión) no son comparables
+                filas = [fila for fila in filas if len(fila[1]) == 8 * len(consulta)]
+                if not filas:
+                    continue
+                vectores = np.array([array("d", fila[1]) for fila in filas])
+                similitud = vectores @ consulta / np.maximum(np.linalg.norm(vectores, axis=1), 1e-12)
+                candidatas = [fila for fila, s in zip(filas, similitud) if s >= self.umbral]
+                random.shuffle(candidatas)
+                candidatas.sort(key=lambda fila: fila[3])
+                elegidas.extend(candidatas[:cuenta])
+
+            if elegidas:
+                self._conn.executemany(
+                    "UPDATE preguntas SET usos = usos + 1 WHERE id = ?", [(fila[0],) for fila in elegidas]
+                )
+                self._conn.commit()
+
+        metrics.contar("banco_preguntas_servidas_total", len(elegidas))
+        return [json.loads(fila[2]) for fila in elegidas]
+
+    def discard_chunks(self, chunk_ids):
+        """Elimina las preguntas basadas en chunks que ya no existen"""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return 0
+        with self._lock:
+            borradas = 0
+            for i in range(0, len(chunk_ids), 500):
+                lote = chunk_ids[i:i + 500]
+                marcas = ",".join("?" * len(lote))
+                borradas += self._conn.execute(
+                    f"DELETE FROM preguntas WHERE id IN ("
+                    f" SELECT pregunta_id FROM pregunta_chunks WHERE chunk_id IN ({marcas}))", lote
+                ).rowcount
+            self._conn.commit()
+        if borradas:
+            logger.info(f"Banco de preguntas: {borradas} preguntas de chunks eliminados descartadas")
+        return borradas
+
+    def discard_collection(self, coleccion):
+        """Elimina las preguntas de una colección borrada"""
+        with self._lock:
+            borradas = self._conn.execute("DELETE FROM preguntas WHERE coleccion = ?", (coleccion,)).rowcount
+            self._conn.commit()
+        return borradas
+
+    def stats(self):
+        """Número de preguntas por tipo"""
+        with self._lock:
+            filas = self._conn.execute("SELECT tipo, COUNT(*) FROM preguntas GROUP BY tipo").fetchall()
+        return dict(filas)
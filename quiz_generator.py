@@ -1,25 +1,171 @@
-import json
 import logging
+import re
+import asyncio
+import queue
+import threading
+import time
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from langchain.prompts import ChatPromptTemplate
-from langchain_ollama import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 from config import CONFIG
+from cache import hash_texto
+from context_builder import ContextBuilder
+from retrieval import CoverageRetriever, HybridRetriever
+from schemas import loads_lenient, validate_question
+from dedup import DuplicateFilter
+from clients import get_llm, get_question_bank
+from question_bank import attribute_chunks, bank_scope
+from metrics import metrics, perfilar
 
 
 
 logger = logging.getLogger(__name__)
 
-class QuizGenerator:
-    def __init__(self, retriever):
-        self.llm = ChatOllama(
-            model=CONFIG["MODELO_LLM"],
-            temperature=0.7,
-            format="json",
-            timeout=60
+# Distribución de un sub-trabajo que sólo genera preguntas de ese tipo
+_DISTRIBUCION_POR_TIPO = {
+    "opcion_multiple": (100, 0, 0),
+    "verdadero_falso": (0, 100, 0),
+    "pregunta_abierta": (0, 0, 100)
+}
+_TIPOS = tuple(_DISTRIBUCION_POR_TIPO)
+
+
+class QuestionStreamParser:
+    """Parser incremental del array "cuestionario" de la salida del LLM.
+
+    Recibe el texto por fragmentos con ``feed`` y devuelve cada objeto
+    pregunta en cuanto su llave de cierre llega, sin esperar al resto.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._en_array = False
+        self._terminado = False
+        self._profundidad = 0
+        self._inicio = None
+        self._en_cadena = False
+        self._escape = False
+
+    def feed(self, fragmento):
+        self.text += fragmento
+        preguntas = []
+
+        if not self._en_array:
+            match = re.search(r'"cuestionario"\s*:\s*\[', self.text)
+            if not match:
+                return preguntas
+            self._en_array = True
+            self._pos = match.end()
+
+        while self._pos < len(self.text) and not self._terminado:
+            c = self.text[self._pos]
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_cadena = False
+            elif c == '"':
+                self._en_cadena = True
+            elif c == "{":
+                if self._profundidad == 0:
+                    self._inicio = self._pos
+                self._profundidad += 1
+            elif c == "}":
+                self._profundidad -= 1
+                if self._profundidad == 0 and self._inicio is not None:
+                    try:
+                        pregunta = loads_lenient(self.text[self._inicio:self._pos + 1])
+                        if isinstance(pregunta, dict):
+                            preguntas.append(pregunta)
+                    except ValueError as je:
+                        logger.warning(f"Pregunta con JSON inválido descartada: {je}")
+                    self._inicio = None
+            elif c == "]" and self._profundidad == 0:
+                self._terminado = True
+            self._pos += 1
+
+        return preguntas
+
+
+class _JobResult:
+    """Preguntas válidas acumuladas por un sub-trabajo a lo largo de sus intentos"""
+
+    def __init__(self, num_questions, excluir=()):
+        self.num_questions = num_questions
+        self.preguntas = []
+        self.vistos = set(excluir)
+        self.metadata = {}
+
+    @property
+    def faltan(self):
+        return self.num_questions - len(self.preguntas)
+
+    def add(self, data, percentages, intento):
+        """Incorpora un intento; devuelve True si no hace falta pedir más"""
+        if "error" not in data:
+            for pregunta in data["cuestionario"]:
+                clave = QuizGenerator._question_key(pregunta)
+                if len(self.preguntas) < self.num_questions and clave not in self.vistos:
+                    self.vistos.add(clave)
+                    self.preguntas.append(pregunta)
+            metadata = data.get("metadata", {})
+            for tema in metadata.get("temas_cubiertos", []):
+                self.metadata.setdefault("temas_cubiertos", [])
+                if tema not in self.metadata["temas_cubiertos"]:
+                    self.metadata["temas_cubiertos"].append(tema)
+            # El modelo indica que no hay información: reintentar no ayuda
+            if not data["cuestionario"] and metadata.get("mensaje"):
+                self.metadata["mensaje"] = metadata["mensaje"]
+                return True
+
+        if self.faltan <= 0:
+            return True
+        motivo = data.get("error") or f"faltan {self.faltan} preguntas válidas"
+        logger.warning(
+            f"Sub-trabajo {percentages} x{self.num_questions} incompleto "
+            f"(intento {intento + 1}/{CONFIG['GENERACION_REINTENTOS'] + 1}): {motivo}"
         )
+        if self.preguntas:
+            metrics.contar("reintentos_parciales_total")
+        return False
+
+    def result(self, ultimo):
+        if not self.preguntas and "error" in ultimo:
+            return ultimo
+        metadata = {**self.metadata, "total_preguntas": len(self.preguntas)}
+        return {"cuestionario": self.preguntas, "metadata": metadata}
+
+
+class QuizGenerator:
+    def __init__(self, retriever, cache=None, context_builder=None, coverage=None, duplicate_filter=None, bank=None):
+        # Cliente compartido: conexiones keep-alive y modelo residente en Ollama
+        self.llm = get_llm(temperature=0.7, format="json")
+        # Recuperación híbrida (BM25 + vectorial) si el retriever es de Chroma
+        if CONFIG["RECUPERACION_MODO"] != "vectorial":
+            retriever = HybridRetriever.from_retriever(retriever) or retriever
         self.retriever = retriever
+        self.context_builder = context_builder or ContextBuilder()
+        # Recuperación por cobertura (MMR + agrupación) si el retriever es de Chroma
+        if coverage is None and CONFIG["RECUPERACION_COBERTURA"]:
+            coverage = CoverageRetriever.from_retriever(retriever)
+        self.coverage = coverage
+        # Filtro de paráfrasis por similitud de embeddings
+        if duplicate_filter is None and CONFIG["DEDUP_SEMANTICO"]:
+            duplicate_filter = DuplicateFilter()
+        self.duplicates = duplicate_filter
         self.output_parser = StrOutputParser()
+        self.cache = cache  # QuizCache opcional
+        # Banco de preguntas, separado por colección (y backend de embeddings)
+        self.bank_scope = bank_scope(getattr(retriever, "vectorstore", None))
+        if bank is None and CONFIG["BANCO_PREGUNTAS"] and self.bank_scope:
+            bank = get_question_bank()
+        self.bank = bank if self.bank_scope else None
 
         # Prompts dedicados
         self.prompt_mixto = ChatPromptTemplate.from_template("""
@@ -172,78 +318,663 @@ Formato de respuesta (SOLO JSON válido):
   }} }}
 """)
 
-    def _get_context(self, topic):
+        # Huella de los prompts: cualquier cambio en ellos invalida la caché
+        self._prompts_hash = hash_texto(*(
+            prompt.messages[0].prompt.template
+            for prompt in (self.prompt_mixto, self.prompt_opcion_multiple,
+                           self.prompt_verdadero_falso, self.prompt_abiertas)
+        ))
+
+    def _get_docs(self, topic):
         try:
-            docs = self.retriever.invoke(topic)
-            if not docs:
-                return ""
-            return "\n\n".join(doc.page_content for doc in docs)
+            with metrics.medir("recuperacion"):
+                docs = self.retriever.invoke(topic)
+            metrics.contar("recuperaciones_total")
+            metrics.contar("recuperacion_documentos_total", len(docs or []))
+            return docs or []
         except Exception as e:
             logger.error(f"Error obteniendo contexto: {str(e)}")
-            return ""
+            return []
 
-    def generate_quiz(self, topic, num_questions=5, percentages=(50, 30, 20)):
+    async def _aget_docs(self, topic):
+        try:
+            with metrics.medir("recuperacion"):
+                docs = await self.retriever.ainvoke(topic)
+            metrics.contar("recuperaciones_total")
+            metrics.contar("recuperacion_documentos_total", len(docs or []))
+            return docs or []
+        except Exception as e:
+            logger.error(f"Error obteniendo contexto: {str(e)}")
+            return []
+
+    def _get_groups(self, topic, num_questions, num_grupos):
+        """Chunks de cada sub-trabajo; con cobertura cada grupo sale de una zona distinta"""
+        if self.coverage is None:
+            return [self._get_docs(topic)] * num_grupos
+        try:
+            with metrics.medir("recuperacion", modo="cobertura"):
+                grupos = self.coverage.retrieve(topic, num_questions, num_grupos)
+            metrics.contar("recuperaciones_total")
+            metrics.contar("recuperacion_documentos_total", len({id(d) for g in grupos for d in g}))
+            return grupos
+        except Exception as e:
+            logger.error(f"Error en la recuperación por cobertura: {str(e)}")
+            return [self._get_docs(topic)] * num_grupos
+
+    async def _aget_groups(self, topic, num_questions, num_grupos):
+        if self.coverage is None:
+            return [await self._aget_docs(topic)] * num_grupos
+        return await asyncio.to_thread(self._get_groups, topic, num_questions, num_grupos)
+
+    def _build_contexts(self, grupos, topic):
+        """Un contexto por sub-trabajo (los grupos repetidos se construyen una vez)"""
+        construidos = {}
+        for grupo in grupos:
+            if id(grupo) not in construidos:
+                construidos[id(grupo)] = self.context_builder.build(grupo, topic)
+        return [construidos[id(grupo)] for grupo in grupos]
+
+    def _invoke_llm(self, formatted_prompt):
+        """Llama al LLM registrando latencia y tokens; devuelve el texto"""
+        inicio = time.perf_counter()
+        result = self.llm.invoke(formatted_prompt)
+        texto = self.output_parser.invoke(result)
+        self._record_llm(formatted_prompt, texto, result, time.perf_counter() - inicio)
+        return texto
+
+    async def _ainvoke_llm(self, formatted_prompt):
+        inicio = time.perf_counter()
+        result = await self.llm.ainvoke(formatted_prompt)
+        texto = self.output_parser.invoke(result)
+        self._record_llm(formatted_prompt, texto, result, time.perf_counter() - inicio)
+        return texto
+
+    @staticmethod
+    def _record_llm(formatted_prompt, texto, result, duracion, tokens_completion=None):
+        """Métricas de una llamada al LLM (tokens según Ollama o estimados)"""
+        meta = getattr(result, "response_metadata", None) or {}
+        tokens_prompt = meta.get("prompt_eval_count") or len(formatted_prompt) // 4
+        tokens_completion = meta.get("eval_count") or tokens_completion or len(texto) // 4
+        duracion_eval = meta.get("eval_duration", 0) / 1e9 or duracion
+
+        metrics.contar("llm_llamadas_total")
+        metrics.observar("llm_segundos", duracion)
+        metrics.contar("tokens_prompt_total", tokens_prompt)
+        metrics.contar("tokens_completion_total", tokens_completion)
+        if duracion_eval > 0:
+            metrics.fijar("llm_tokens_por_segundo", round(tokens_completion / duracion_eval, 2))
+
+    def _build_prompt(self, context, num_questions, percentages):
+        """Selecciona el prompt según la distribución y prepara sus variables"""
+        p_op, p_vf, p_ab = percentages
+
+        if p_op == 100:
+            prompt = self.prompt_opcion_multiple
+            prompt_inputs = {
+                "context": context,
+                "num_preguntas": str(num_questions)
+            }
+        elif p_vf == 100:
+            prompt = self.prompt_verdadero_falso
+            prompt_inputs = {
+                "context": context,
+                "num_preguntas": str(num_questions)
+            }
+        elif p_ab == 100:
+            prompt = self.prompt_abiertas
+            prompt_inputs = {
+                "context": context,
+                "num_preguntas": str(num_questions)
+            }
+        else:
+            # Mixto
+            prompt = self.prompt_mixto
+            prompt_inputs = {
+                "context": context,
+                "num_preguntas": str(num_questions),
+                "porcentaje_op_multiple": str(p_op),
+                "porcentaje_vf": str(p_vf),
+                "porcentaje_abiertas": str(p_ab)
+            }
+        return prompt.format(**prompt_inputs)
+
+    @staticmethod
+    def _limit_questions(num_questions):
         if num_questions > CONFIG["MAX_PREGUNTAS"]:
             num_questions = CONFIG["MAX_PREGUNTAS"]
             logger.warning(f"Número de preguntas reducido a {CONFIG['MAX_PREGUNTAS']}")
+        return num_questions
 
-        try:
-            context = self._get_context(topic)
-            p_op, p_vf, p_ab = percentages
-
-            # Seleccionamos prompt según distribución
-            if p_op == 100:
-                prompt = self.prompt_opcion_multiple
-                prompt_inputs = {
-                    "context": context,
-                    "num_preguntas": str(num_questions)
-                }
-            elif p_vf == 100:
-                prompt = self.prompt_verdadero_falso
-                prompt_inputs = {
-                    "context": context,
-                    "num_preguntas": str(num_questions)
-                }
-            elif p_ab == 100:
-                prompt = self.prompt_abiertas
-                prompt_inputs = {
-                    "context": context,
-                    "num_preguntas": str(num_questions)
-                }
-            else:
-                # Mixto
-                prompt = self.prompt_mixto
-                prompt_inputs = {
-                    "context": context,
-                    "num_preguntas": str(num_questions),
-                    "porcentaje_op_multiple": str(p_op),
-                    "porcentaje_vf": str(p_vf),
-                    "porcentaje_abiertas": str(p_ab)
-                }
-
-            logger.info("Generando cuestionario...")
-            formatted_prompt = prompt.format(**prompt_inputs)
-            result = self.llm.invoke(formatted_prompt)
-            return self._parse_result(self.output_parser.invoke(result))
+    def _cache_key(self, contexts, num_questions, percentages, parallel):
+        return hash_texto(
+            CONFIG["MODELO_LLM"], self._prompts_hash, *contexts,
+            num_questions, tuple(percentages), bool(parallel)
+        )
 
+    def _jobs(self, num_questions, percentages, parallel):
+        if parallel:
+            return self._plan_jobs(num_questions, percentages)
+        return [(tuple(percentages), num_questions)]
+
+    def _from_cache(self, clave, fresh):
+        if self.cache is None or fresh:
+            return None
+        quiz = self.cache.get(clave)
+        if quiz is not None:
+            logger.info("Cuestionario servido desde caché")
+            quiz.setdefault("metadata", {})["desde_cache"] = True
+        return quiz
+
+    def _to_cache(self, clave, quiz):
+        if self.cache is not None and "error" not in quiz and quiz.get("cuestionario"):
+            self.cache.put(clave, quiz)
+
+    def _from_bank(self, topic, num_questions, percentages, fresh):
+        """Preguntas servidas desde el banco y lo que queda por generar (n, porcentajes)"""
+        if self.bank is None or fresh or not CONFIG["BANCO_ENSAMBLAR"]:
+            return [], num_questions, percentages
+        cuentas = dict(zip(_TIPOS, self._type_counts(num_questions, percentages)))
+        try:
+            with metrics.medir("banco"):
+                banco = self.bank.take(self.bank_scope, topic, cuentas)
+        except Exception as e:
+            logger.error(f"Error consultando el banco de preguntas: {str(e)}")
+            return [], num_questions, percentages
+        if not banco:
+            return [], num_questions, percentages
+
+        servidas = Counter(p.get("tipo") for p in banco)
+        faltan = [cuentas[tipo] - servidas[tipo] for tipo in _TIPOS]
+        pendientes = sum(faltan)
+        logger.info(f"{len(banco)} preguntas servidas desde el banco, {pendientes} por generar")
+        if not pendientes:
+            return banco, 0, percentages
+        return banco, pendientes, tuple(round(100 * f / pendientes) for f in faltan)
+
+    def _to_bank(self, quiz, grupos, topic):
+        """Guarda en el banco las preguntas generadas con los chunks de los que salen"""
+        if self.bank is None or "error" in quiz or not quiz.get("cuestionario"):
+            return
+        try:
+            docs = list({id(d): d for grupo in grupos for d in grupo}.values())
+            self.bank.add(
+                self.bank_scope, topic,
+                [(pregunta, attribute_chunks(pregunta, docs)) for pregunta in quiz["cuestionario"]]
+            )
+        except Exception as e:
+            logger.error(f"Error guardando preguntas en el banco: {str(e)}")
+
+    @staticmethod
+    def _with_bank(quiz, banco, num_questions):
+        """Antepone las preguntas del banco a las generadas"""
+        if not banco:
+            return quiz
+        if "error" in quiz:
+            logger.warning(f"Sólo se sirven las preguntas del banco: {quiz['error']}")
+            quiz = {"cuestionario": [], "metadata": {}}
+        preguntas = banco + quiz.get("cuestionario", [])
+        metadata = {
+            **quiz.get("metadata", {}), "total_preguntas": len(preguntas), "desde_banco": len(banco)
+        }
+        metadata.pop("preguntas_faltantes", None)
+        if len(preguntas) < num_questions:
+            metadata["preguntas_faltantes"] = num_questions - len(preguntas)
+        return {**quiz, "cuestionario": preguntas, "metadata": metadata}
+
+    def generate_quiz(self, topic, num_questions=5, percentages=(50, 30, 20), parallel=None, fresh=False):
+        """Genera un cuestionario; con ``fresh`` se ignoran la caché de resultados y el banco.
+
+        Con el banco activo se sirven primero las preguntas ya generadas
+        para un tema parecido y el LLM sólo genera las que faltan.
+        """
+        num_questions = self._limit_questions(num_questions)
+        if parallel is None:
+            parallel = CONFIG["GENERACION_PARALELA"]
+
+        with metrics.solicitud(), perfilar("generate_quiz"), metrics.medir("generacion", modo="sync"):
+            try:
+                banco, pendientes, distribucion = self._from_bank(topic, num_questions, percentages, fresh)
+                if not pendientes:
+                    return self._with_bank({"cuestionario": [], "metadata": {}}, banco, num_questions)
+
+                jobs = self._jobs(pendientes, distribucion, parallel)
+                grupos = self._get_groups(topic, pendientes, len(jobs))
+                contexts = self._build_contexts(grupos, topic)
+                clave = self._cache_key(contexts, pendientes, distribucion, parallel)
+                quiz = self._from_cache(clave, fresh)
+                if quiz is None:
+                    origenes = {}
+                    if parallel:
+                        quiz, origenes = self._generate_parallel(jobs, contexts, pendientes)
+                    else:
+                        logger.info("Generando cuestionario...")
+                        quiz = self._run_job(contexts[0], pendientes, distribucion)
+
+                    quiz = self._drop_duplicates(quiz, contexts, pendientes, banco, origenes)
+                    self._to_cache(clave, quiz)
+                    self._to_bank(quiz, grupos, topic)
+                return self._with_bank(quiz, banco, num_questions)
+
+            except Exception as e:
+                logger.error(f"Error generando cuestionario: {str(e)}", exc_info=True)
+                return {"error": str(e), "detalle": "Falló la generación del cuestionario"}
+
+    async def agenerate_quiz(self, topic, num_questions=5, percentages=(50, 30, 20), parallel=None, fresh=False):
+        """Versión asíncrona de ``generate_quiz`` sobre los clientes async de Ollama"""
+        num_questions = self._limit_questions(num_questions)
+        if parallel is None:
+            parallel = CONFIG["GENERACION_PARALELA"]
+
+        with metrics.solicitud(), perfilar("agenerate_quiz"), metrics.medir("generacion", modo="async"):
+            try:
+                banco, pendientes, distribucion = await asyncio.to_thread(
+                    self._from_bank, topic, num_questions, percentages, fresh
+                )
+                if not pendientes:
+                    return self._with_bank({"cuestionario": [], "metadata": {}}, banco, num_questions)
+
+                jobs = self._jobs(pendientes, distribucion, parallel)
+                grupos = await self._aget_groups(topic, pendientes, len(jobs))
+                contexts = self._build_contexts(grupos, topic)
+                clave = self._cache_key(contexts, pendientes, distribucion, parallel)
+                quiz = await asyncio.to_thread(self._from_cache, clave, fresh)
+                if quiz is None:
+                    origenes = {}
+                    if parallel:
+                        quiz, origenes = await self._agenerate_parallel(jobs, contexts, pendientes)
+                    else:
+                        logger.info("Generando cuestionario...")
+                        quiz = await self._arun_job(contexts[0], pendientes, distribucion)
+
+                    quiz = await asyncio.to_thread(
+                        self._drop_duplicates, quiz, contexts, pendientes, banco, origenes
+                    )
+                    await asyncio.to_thread(self._to_cache, clave, quiz)
+                    await asyncio.to_thread(self._to_bank, quiz, grupos, topic)
+                return self._with_bank(quiz, banco, num_questions)
+
+            except Exception as e:
+                logger.error(f"Error generando cuestionario: {str(e)}", exc_info=True)
+                return {"error": str(e), "detalle": "Falló la generación del cuestionario"}
+
+    @staticmethod
+    def _type_counts(num_questions, percentages):
+        """Preguntas de cada tipo (método del mayor resto sobre los porcentajes normalizados)"""
+        total = sum(percentages)
+        if total <= 0:
+            raise ValueError("La distribución de preguntas no puede ser 0%")
+
+        cuotas = [num_questions * p / total for p in percentages]
+        cuentas = [int(c) for c in cuotas]
+        restos = sorted(range(3), key=lambda i: cuotas[i] - cuentas[i], reverse=True)
+        for i in restos[:num_questions - sum(cuentas)]:
+            cuentas[i] += 1
+        return cuentas
+
+    @staticmethod
+    def _plan_jobs(num_questions, percentages):
+        """Reparte las preguntas en sub-trabajos (porcentajes de un solo tipo, n).
+
+        Cada tipo recibe su cuota según ``_type_counts`` y se trocea en
+        lotes de ``PREGUNTAS_POR_LOTE`` preguntas.
+        """
+        cuentas = QuizGenerator._type_counts(num_questions, percentages)
+
+        lote = CONFIG["PREGUNTAS_POR_LOTE"]
+        jobs = []
+        for i, cuenta in enumerate(cuentas):
+            distribucion = tuple(100 if j == i else 0 for j in range(3))
+            for inicio in range(0, cuenta, lote):
+                jobs.append((distribucion, min(lote, cuenta - inicio)))
+        return jobs
+
+    def _run_job(self, context, num_questions, percentages, excluir=()):
+        """Ejecuta un sub-trabajo; en cada reintento sólo pide las preguntas que faltan"""
+        acumulado = _JobResult(num_questions, excluir)
+        for intento in range(CONFIG["GENERACION_REINTENTOS"] + 1):
+            try:
+                formatted_prompt = self._build_prompt(context, acumulado.faltan, percentages)
+                data = self._parse_result(self._invoke_llm(formatted_prompt))
+            except Exception as e:
+                data = {"error": str(e)}
+            if acumulado.add(data, percentages, intento):
+                break
+        return acumulado.result(data)
+
+    @staticmethod
+    def _origins(resultados):
+        """Índice del contexto del que salió cada pregunta (por enunciado normalizado)"""
+        return {
+            QuizGenerator._question_key(pregunta): i
+            for i, resultado in enumerate(resultados)
+            for pregunta in resultado.get("cuestionario", [])
+        }
+
+    def _generate_parallel(self, jobs, contexts, num_questions):
+        """Genera el cuestionario con sub-trabajos concurrentes (uno por contexto).
+
+        Devuelve el resultado fusionado y el contexto de origen de cada pregunta.
+        """
+        logger.info(f"Generando cuestionario en {len(jobs)} sub-trabajos paralelos...")
+
+        pool = ThreadPoolExecutor(max_workers=CONFIG["GENERACION_WORKERS"])
+        try:
+            # Cada hilo hereda el contexto (id de petición de las métricas)
+            futuros = [
+                pool.submit(contextvars.copy_context().run, self._run_job, context, n, distribucion)
+                for (distribucion, n), context in zip(jobs, contexts)
+            ]
+            resultados = [futuro.result() for futuro in futuros]
+        finally:
+            # Si algo falla o se interrumpe, los sub-trabajos en cola no llegan a lanzarse
+            pool.shutdown(wait=False, cancel_futures=True)
+        return self._merge_results(resultados, num_questions), self._origins(resultados)
+
+    async def _arun_job(self, context, num_questions, percentages, excluir=()):
+        """Versión asíncrona de ``_run_job``"""
+        acumulado = _JobResult(num_questions, excluir)
+        for intento in range(CONFIG["GENERACION_REINTENTOS"] + 1):
+            try:
+                formatted_prompt = self._build_prompt(context, acumulado.faltan, percentages)
+                data = self._parse_result(await self._ainvoke_llm(formatted_prompt))
+            except Exception as e:
+                data = {"error": str(e)}
+            if acumulado.add(data, percentages, intento):
+                break
+        return acumulado.result(data)
+
+    async def _agenerate_parallel(self, jobs, contexts, num_questions):
+        """Versión asíncrona de ``_generate_parallel`` limitada a GENERACION_WORKERS"""
+        logger.info(f"Generando cuestionario en {len(jobs)} sub-trabajos paralelos...")
+        limite = asyncio.Semaphore(CONFIG["GENERACION_WORKERS"])
+
+        async def ejecutar(job, context):
+            async with limite:
+                return await self._arun_job(context, job[1], job[0])
+
+        resultados = await asyncio.gather(*(ejecutar(job, context) for job, context in zip(jobs, contexts)))
+        return self._merge_results(resultados, num_questions), self._origins(resultados)
+
+    def stream_quiz(self, topic, num_questions=5, percentages=(50, 30, 20), parallel=None, fresh=False):
+        """Genera el cuestionario en streaming.
+
+        Produce eventos ``("pregunta", dict)`` en cuanto cada pregunta está
+        completa en el flujo de tokens (las del banco, de inmediato) y, al
+        final, ``("cuestionario", quiz)`` con el mismo formato que ``generate_quiz``.
+        """
+        num_questions = self._limit_questions(num_questions)
+        if parallel is None:
+            parallel = CONFIG["GENERACION_PARALELA"]
+
+        with metrics.solicitud(), metrics.medir("generacion", modo="stream"):
+            try:
+                banco, pendientes, distribucion = self._from_bank(topic, num_questions, percentages, fresh)
+                for pregunta in banco:
+                    yield ("pregunta", pregunta)
+                if not pendientes:
+                    yield ("cuestionario", self._with_bank({"cuestionario": [], "metadata": {}}, banco, num_questions))
+                    return
+
+                jobs = self._jobs(pendientes, distribucion, parallel)
+                grupos = self._get_groups(topic, pendientes, len(jobs))
+                contexts = self._build_contexts(grupos, topic)
+                clave = self._cache_key(contexts, pendientes, distribucion, parallel)
+                quiz = self._from_cache(clave, fresh)
+                if quiz is not None:
+                    for pregunta in quiz.get("cuestionario", []):
+                        yield ("pregunta", pregunta)
+                    yield ("cuestionario", self._with_bank(quiz, banco, num_questions))
+                    return
+
+                logger.info(f"Generando cuestionario en streaming ({len(jobs)} sub-trabajos)...")
+
+                eventos = queue.Queue()
+                cancelado = threading.Event()
+
+                def trabajar(indice, job, context):
+                    try:
+                        resultado = self._stream_job(context, job[1], job[0], eventos, cancelado, indice)
+                    except Exception as e:
+                        resultado = {"error": str(e)}
+                    eventos.put(("resultado", resultado, indice))
+
+                resultados, vistos, emitidas, duplicadas = [], set(), [], []
+                pool = ThreadPoolExecutor(max_workers=CONFIG["GENERACION_WORKERS"])
+                try:
+                    for indice, (job, context) in enumerate(zip(jobs, contexts)):
+                        pool.submit(contextvars.copy_context().run, trabajar, indice, job, context)
+
+                    while len(resultados) < len(jobs):
+                        tipo, valor, indice = eventos.get()
+                        if tipo == "resultado":
+                            resultados.append(valor)
+                            continue
+                        clave_pregunta = self._question_key(valor)
+                        if clave_pregunta and clave_pregunta in vistos:
+                            continue
+                        vistos.add(clave_pregunta)
+                        if self._is_paraphrase(valor, banco + emitidas):
+                            # Se repone desde el mismo contexto que la produjo
+                            duplicadas.append((valor, indice))
+                            continue
+                        emitidas.append(valor)
+                        yield ("pregunta", valor)
+                finally:
+                    # Si se cierra el generador (trabajo cancelado) no se espera a nadie:
+                    # los sub-trabajos en cola no se lanzan y los que están en curso cortan su stream
+                    cancelado.set()
+                    pool.shutdown(wait=False, cancel_futures=True)
+
+                quiz = self._merge_results(resultados, pendientes)
+                if "error" not in quiz and duplicadas:
+                    metrics.contar("preguntas_duplicadas_total", len(duplicadas))
+                    nuevas = self._top_up(banco + emitidas, duplicadas, contexts, num_questions)
+                    for pregunta in nuevas:
+                        yield ("pregunta", pregunta)
+                    quiz = self._with_questions(quiz, emitidas + nuevas, pendientes, len(duplicadas))
+                self._to_cache(clave, quiz)
+                self._to_bank(quiz, grupos, topic)
+                yield ("cuestionario", self._with_bank(quiz, banco, num_questions))
+
+            except Exception as e:
+                logger.error(f"Error generando cuestionario: {str(e)}", exc_info=True)
+                yield ("cuestionario", {"error": str(e), "detalle": "Falló la generación del cuestionario"})
+
+    def _is_paraphrase(self, pregunta, previas):
+        """True si la pregunta es casi idéntica a alguna de las ya aceptadas"""
+        if self.duplicates is None or not previas:
+            return False
+        try:
+            return not self.duplicates.split([pregunta], previas)[0]
         except Exception as e:
-            logger.error(f"Error generando cuestionario: {str(e)}", exc_info=True)
-            return {"error": str(e), "detalle": "Falló la generación del cuestionario"}
+            logger.error(f"Error comparando preguntas: {str(e)}")
+            return False
+
+    def _top_up(self, preguntas, duplicadas, contexts, num_questions):
+        """Pide sólo las preguntas necesarias para reponer las duplicadas.
+
+        ``duplicadas`` son pares (pregunta, índice del contexto del que
+        salió); se repone por tipo desde ese mismo contexto.
+        """
+        nuevas = []
+        excluir = {self._question_key(p) for p in preguntas} | {self._question_key(p) for p, _ in duplicadas}
+        por_origen = Counter((p.get("tipo"), min(indice, len(contexts) - 1)) for p, indice in duplicadas)
+        for (tipo, indice), cuenta in por_origen.items():
+            cuenta = min(cuenta, num_questions - len(preguntas) - len(nuevas))
+            if cuenta <= 0:
+                break
+            distribucion = _DISTRIBUCION_POR_TIPO.get(tipo, (50, 30, 20))
+            extra = self._run_job(contexts[indice], cuenta, distribucion, excluir)
+            aceptadas, repetidas = self.duplicates.split(extra.get("cuestionario", []), preguntas + nuevas)
+            if repetidas:
+                metrics.contar("preguntas_duplicadas_total", len(repetidas))
+            nuevas.extend(aceptadas)
+        return nuevas
+
+    @staticmethod
+    def _with_questions(quiz, preguntas, num_questions, descartadas):
+        metadata = {**quiz.get("metadata", {}), "total_preguntas": len(preguntas), "duplicadas_descartadas": descartadas}
+        metadata.pop("preguntas_faltantes", None)
+        if len(preguntas) < num_questions:
+            metadata["preguntas_faltantes"] = num_questions - len(preguntas)
+        return {**quiz, "cuestionario": preguntas, "metadata": metadata}
+
+    def _drop_duplicates(self, quiz, contexts, num_questions, previas=(), origenes=None):
+        """Descarta paráfrasis (un solo lote de embeddings) y repone sólo lo que falta.
+
+        Las ``previas`` (las servidas desde el banco) cuentan como aceptadas
+        pero no se incluyen en el resultado. ``origenes`` da el contexto del
+        que salió cada pregunta (el primero si no consta).
+        """
+        if self.duplicates is None or "error" in quiz or not quiz.get("cuestionario"):
+            return quiz
+        try:
+            preguntas, duplicadas = self.duplicates.split(quiz["cuestionario"], previas)
+            if not duplicadas:
+                return quiz
+            metrics.contar("preguntas_duplicadas_total", len(duplicadas))
+            origenes = origenes or {}
+            duplicadas = [(p, origenes.get(self._question_key(p), 0)) for p in duplicadas]
+            preguntas += self._top_up(list(previas) + preguntas, duplicadas, contexts, num_questions + len(previas))
+        except Exception as e:
+            logger.error(f"Error filtrando preguntas duplicadas: {str(e)}")
+            return quiz
+        return self._with_questions(quiz, preguntas, num_questions, len(duplicadas))
+
+    def _stream_job(self, context, num_questions, percentages, eventos, cancelado=None, indice=0):
+        """Ejecuta un sub-trabajo en streaming publicando ``("pregunta", dict, indice)`` en ``eventos``.
+
+        Si se activa ``cancelado`` se deja de leer el stream y no se reintenta.
+        """
+        parser = QuestionStreamParser()
+        emitidas = []
+
+        def emitir(pregunta):
+            if len(emitidas) < num_questions:
+                emitidas.append(pregunta)
+                eventos.put(("pregunta", pregunta, indice))
+
+        formatted_prompt = self._build_prompt(context, num_questions, percentages)
+        inicio = time.perf_counter()
+        fragmentos = 0
+        ultimo = None
+        for fragmento in self.llm.stream(formatted_prompt):
+            if cancelado is not None and cancelado.is_set():
+                return {"error": "cancelado"}
+            fragmentos += 1
+            ultimo = fragmento
+            for pregunta in parser.feed(fragmento.content):
+                pregunta = validate_question(pregunta)
+                if pregunta is None:
+                    continue
+                if not emitidas:
+                    metrics.observar("primera_pregunta_segundos", time.perf_counter() - inicio)
+                emitir(pregunta)
+        self._record_llm(formatted_prompt, parser.text, ultimo, time.perf_counter() - inicio, fragmentos)
+
+        data = self._parse_result(parser.text)
+        if "error" not in data:
+            for pregunta in data["cuestionario"][len(emitidas):]:
+                emitir(pregunta)
+
+        sin_informacion = "error" not in data and not data["cuestionario"] and data.get("metadata", {}).get("mensaje")
+        if cancelado is not None and cancelado.is_set():
+            return {"error": "cancelado"}
+        if len(emitidas) < num_questions and not sin_informacion:
+            # Sólo se piden de nuevo las preguntas que faltan o eran inválidas
+            extra = self._run_job(
+                context, num_questions - len(emitidas), percentages,
+                excluir={self._question_key(p) for p in emitidas}
+            )
+            for pregunta in extra.get("cuestionario", []):
+                emitir(pregunta)
+            if not emitidas:
+                return extra
+            data = {"cuestionario": [], "metadata": {**extra.get("metadata", {}), **data.get("metadata", {})}}
+
+        data["cuestionario"] = emitidas
+        return data
+
+    @staticmethod
+    def _question_key(pregunta):
+        """Enunciado normalizado, usado para deduplicar preguntas"""
+        return re.sub(r"\W+", " ", str(pregunta.get("enunciado", ""))).strip().lower()
+
+    @staticmethod
+    def _merge_results(resultados, num_questions):
+        """Fusiona resultados parciales en el formato {"cuestionario", "metadata"}"""
+        preguntas, temas, vistos, mensajes = [], [], set(), []
+        fallidos = [r for r in resultados if "error" in r]
+
+        for resultado in resultados:
+            if "error" in resultado:
+                continue
+            for pregunta in resultado.get("cuestionario", []):
+                clave = QuizGenerator._question_key(pregunta)
+                if clave and clave in vistos:
+                    continue
+                vistos.add(clave)
+                preguntas.append(pregunta)
+
+            metadata = resultado.get("metadata", {})
+            for tema in metadata.get("temas_cubiertos", []):
+                if tema not in temas:
+                    temas.append(tema)
+            if metadata.get("mensaje"):
+                mensajes.append(metadata["mensaje"])
+
+        if fallidos and not preguntas:
+            return {
+                "error": fallidos[0]["error"],
+                "detalle": "Fallaron todos los sub-trabajos de generación",
+                "raw_response": fallidos[0].get("raw_response", "")
+            }
+
+        metadata = {
+            "temas_cubiertos": temas,
+            "total_preguntas": len(preguntas)
+        }
+        if fallidos:
+            metadata["sub_trabajos_fallidos"] = len(fallidos)
+        if len(preguntas) < num_questions:
+            metadata["preguntas_faltantes"] = num_questions - len(preguntas)
+        if mensajes and not preguntas:
+            metadata["mensaje"] = mensajes[0]
+        return {"cuestionario": preguntas, "metadata": metadata}
 
     def _parse_result(self, raw_result):
-        try:
-            cleaned = raw_result.strip()
-            if cleaned.startswith("```json"):
-                cleaned = cleaned[7:-3].strip()
+        """Interpreta la salida del LLM conservando todas las preguntas válidas.
 
-            data = json.loads(cleaned)
-            if not isinstance(data, dict) or "cuestionario" not in data:
-                raise ValueError("Formato inválido")
+        Se intenta JSON estricto, después JSON5 y, si el texto está truncado,
+        se rescatan los objetos completos del array "cuestionario". Cada
+        pregunta se valida con su esquema y las inválidas se descartan.
+        """
+        cleaned = raw_result.strip()
+        if cleaned.startswith("```"):
+            cleaned = re.sub(r"^```(?:json)?|```$", "", cleaned).strip()
 
-            return data
-        except json.JSONDecodeError as je:
-            logger.error(f"Error JSON: {je}")
-            return {"error": "JSON inválido", "raw_response": raw_result}
+        try:
+            data = loads_lenient(cleaned)
+            if not isinstance(data, dict) or not isinstance(data.get("cuestionario"), list):
+                raise ValueError("Formato inválido")
         except Exception as e:
-            logger.error(f"Error validando cuestionario: {e}")
-            return {"error": str(e), "raw_response": raw_result}
\ No newline at end of file
+            rescatadas = QuestionStreamParser().feed(cleaned)
+            if not rescatadas:
+                logger.error(f"Error JSON: {e}")
+                metrics.contar("json_errores_total")
+                return {"error": "JSON inválido", "raw_response": raw_result}
+            logger.warning(f"JSON inválido ({e}); rescatadas {len(rescatadas)} preguntas")
+            metrics.contar("json_reparados_total")
+            data = {"cuestionario": rescatadas, "metadata": {}}
+
+        validas = [p for p in map(validate_question, data["cuestionario"]) if p is not None]
+        descartadas = len(data["cuestionario"]) - len(validas)
+        if descartadas:
+            metrics.contar("preguntas_invalidas_total", descartadas)
+        if not validas and descartadas:
+            return {"error": "Ninguna pregunta válida", "raw_response": raw_result}
+
+        metadata = data.get("metadata")
+        data["metadata"] = metadata if isinstance(metadata, dict) else {}
+        data["cuestionario"] = validas
+        return data
\ No newline at end of file
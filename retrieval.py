@@ -0,0 +1,287 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Any, List
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from config import CONFIG
+from lexical import open_index
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Consultas de embedding en curso (para detectar un servidor saturado)
+_lock = threading.Lock()
+_en_vuelo = 0
+_pool = None
+
+
+def _normalize(matriz):
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    return matriz / np.where(normas == 0, 1, normas)
+
+
+def _min_max(valores):
+    rango = valores.max() - valores.min() if len(valores) else 0
+    return (valores - valores.min()) / rango if rango else np.ones_like(valores)
+
+
+def embed_query_fast(embeddings, texto):
+    """Embebe la consulta sólo si el servidor de embeddings responde a tiempo.
+
+    Devuelve None (usar sólo BM25) si ya hay ``HIBRIDO_EMBEDDINGS_EN_VUELO``
+    consultas en curso o si la respuesta tarda más de
+    ``HIBRIDO_TIMEOUT_EMBEDDING`` segundos. En ese caso la petición sigue en
+    segundo plano y su vector queda en la caché para la siguiente consulta.
+    """
+    global _en_vuelo, _pool
+    with _lock:
+        if _en_vuelo >= CONFIG["HIBRIDO_EMBEDDINGS_EN_VUELO"]:
+            metrics.contar("recuperacion_solo_lexica_total", motivo="saturado")
+            return None
+        _en_vuelo += 1
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=CONFIG["HIBRIDO_EMBEDDINGS_EN_VUELO"], thread_name_prefix="consulta"
+            )
+
+    def embeber():
+        global _en_vuelo
+        try:
+            return embeddings.embed_query(texto)
+        finally:
+            with _lock:
+                _en_vuelo -= 1
+
+    futuro = _pool.submit(embeber)
+    try:
+        return futuro.result(timeout=CONFIG["HIBRIDO_TIMEOUT_EMBEDDING"])
+    except FuturesTimeout:
+        logger.warning("El servidor de embeddings no responde a tiempo: recuperación sólo léxica")
+        metrics.contar("recuperacion_solo_lexica_total", motivo="timeout")
+    except Exception as e:
+        logger.warning(f"Error embebiendo la consulta ({e}): recuperación sólo léxica")
+        metrics.contar("recuperacion_solo_lexica_total", motivo="error")
+    return None
+
+
+def _sample_ids(collection, lexical, k):
+    """``k`` IDs repartidos a lo largo de la colección (en el orden del índice BM25)"""
+    ids = lexical.ids or collection.get(include=[])["ids"]
+    paso = max(1, len(ids) // max(k, 1))
+    return ids[::paso][:k]
+
+
+def _candidates(vectorstore, lexical, texto, fetch_k, modo):
+    """Candidatos de la búsqueda vectorial y de BM25 con su relevancia fusionada.
+
+    Devuelve (ids, documentos, embeddings normalizados, relevancia). Los
+    candidatos sólo léxicos toman su embedding ya almacenado en Chroma, así
+    que el camino sin consulta embebida no llama al servidor de embeddings.
+    """
+    collection = vectorstore._collection
+    fetch_k = min(fetch_k, collection.count())
+    if not fetch_k:
+        return [], [], np.zeros((0, 0)), np.zeros(0)
+
+    if lexical is None:
+        lexicos, consulta = {}, vectorstore._embedding_function.embed_query(texto)
+    else:
+        lexicos = dict(lexical.search(texto, fetch_k))
+        consulta = None if modo == "lexico" else embed_query_fast(vectorstore._embedding_function, texto)
+        if consulta is None and not lexicos:
+            # Sin términos en común ni vector a tiempo no se devuelve un contexto
+            # vacío: se espera a la búsqueda vectorial o, si no hay, se muestrea
+            if modo != "lexico":
+                try:
+                    consulta = vectorstore._embedding_function.embed_query(texto)
+                except Exception as e:
+                    logger.warning(f"Error embebiendo la consulta ({e}): se muestrean chunks del documento")
+            if consulta is None:
+                lexicos = {id_: 0.0 for id_ in _sample_ids(collection, lexical, fetch_k)}
+                metrics.contar("recuperacion_muestra_total")
+
+    campos = ("ids", "documents", "metadatas", "embeddings")
+    ids, textos, metadatos, vectores = [], [], [], []
+    if consulta is not None:
+        res = collection.query(
+            query_embeddings=[consulta], n_results=fetch_k, include=["documents", "metadatas", "embeddings"]
+        )
+        ids, textos, metadatos, vectores = (list(res[c][0]) for c in campos)
+
+    vistos = set(ids)
+    faltan = [id_ for id_ in lexicos if id_ not in vistos]
+    if faltan:
+        res = collection.get(ids=faltan, include=["documents", "metadatas", "embeddings"])
+        for lista, c in zip((ids, textos, metadatos, vectores), campos):
+            lista.extend(res[c])
+    if not ids:
+        return [], [], np.zeros((0, 0)), np.zeros(0)
+
+    vectores = _normalize(np.array(vectores, dtype=float))
+    bm25 = np.array([lexicos.get(id_, 0.0) for id_ in ids])
+    if consulta is None:
+        relevancia = _min_max(bm25)
+    else:
+        similitud = vectores @ _normalize(np.array([consulta], dtype=float))[0]
+        if lexicos:
+            peso = CONFIG["HIBRIDO_PESO_LEXICO"]
+            relevancia = (1 - peso) * _min_max(similitud) + peso * _min_max(bm25)
+        else:
+            relevancia = similitud
+
+    docs = [Document(id=i, page_content=t, metadata=m or {}) for i, t, m in zip(ids, textos, metadatos)]
+    return ids, docs, vectores, relevancia
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever que fusiona BM25 y similitud vectorial sobre una colección Chroma.
+
+    Las puntuaciones de ambas búsquedas se normalizan y se combinan con
+    ``HIBRIDO_PESO_LEXICO``; los términos exactos (nombres, fórmulas,
+    fechas) que los embeddings diluyen suben así en el ranking. Con el
+    servidor de embeddings saturado, o en modo ``"lexico"``, responde sólo
+    con BM25 sin tocar la red.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    k: int = 4
+    modo: str = "hibrido"
+
+    @classmethod
+    def from_retriever(cls, retriever, modo=None):
+        """Envuelve un retriever de Chroma (o None si no aplica)"""
+        if isinstance(retriever, cls):
+            return retriever
+        vectorstore = getattr(retriever, "vectorstore", None)
+        if vectorstore is None or not hasattr(vectorstore, "_collection"):
+            return None
+        try:
+            lexical = open_index(vectorstore)
+        except Exception as e:
+            logger.warning(f"No se pudo abrir el índice BM25: {str(e)}")
+            return None
+        if lexical is None:
+            return None
+        k = getattr(retriever, "search_kwargs", {}).get("k", 4)
+        return cls(vectorstore=vectorstore, lexical=lexical, k=k, modo=modo or CONFIG["RECUPERACION_MODO"])
+
+    def _get_relevant_documents(self, query, *, run_manager) -> List[Document]:
+        if self.modo == "lexico":
+            # Camino rápido: ni embeddings ni Chroma
+            ids = [id_ for id_, _ in self.lexical.search(query, self.k)]
+            if not ids:
+                ids = _sample_ids(self.vectorstore._collection, self.lexical, self.k)
+                metrics.contar("recuperacion_muestra_total")
+            return self.lexical.documents(ids)
+
+        _, docs, _, relevancia = _candidates(self.vectorstore, self.lexical, query, max(4 * self.k, 20), self.modo)
+        return [docs[i] for i in np.argsort(-relevancia)[:self.k]]
+
+
+class CoverageRetriever:
+    """Recuperación orientada a cobertura sobre una colección Chroma.
+
+    Selecciona con MMR un número de chunks proporcional al número de
+    preguntas y los agrupa (k-means sobre los embeddings almacenados) para
+    que cada sub-trabajo de generación reciba una zona distinta del
+    documento en lugar de los mismos pocos fragmentos.
+    """
+
+    def __init__(self, vectorstore, chunks_por_pregunta=None, k_min=5, k_max=None, lambda_mult=None,
+                 lexical=None, modo="hibrido"):
+        self.vectorstore = vectorstore
+        # Índice BM25: los candidatos se fusionan con los de la búsqueda vectorial
+        self.lexical = lexical
+        self.modo = modo
+        self.chunks_por_pregunta = chunks_por_pregunta or CONFIG["CHUNKS_POR_PREGUNTA"]
+        self.k_min = k_min
+        self.k_max = k_max or CONFIG["RECUPERACION_K_MAX"]
+        self.lambda_mult = CONFIG["MMR_LAMBDA"] if lambda_mult is None else lambda_mult
+
+    @classmethod
+    def from_retriever(cls, retriever):
+        """Crea el recuperador a partir de un retriever de Chroma (o None si no aplica)"""
+        vectorstore = getattr(retriever, "vectorstore", None)
+        if vectorstore is None or not hasattr(vectorstore, "_collection"):
+            return None
+        k = getattr(retriever, "k", None) or getattr(retriever, "search_kwargs", {}).get("k", 5)
+        return cls(
+            vectorstore, k_min=k,
+            lexical=getattr(retriever, "lexical", None), modo=getattr(retriever, "modo", "hibrido")
+        )
+
+    def _mmr(self, relevancia, embeddings, k):
+        """Índices elegidos por Maximal Marginal Relevance, en orden de selección"""
+        elegidos = [int(np.argmax(relevancia))]
+        similitud_max = embeddings @ embeddings[elegidos[0]]
+
+        while len(elegidos) < k:
+            puntuacion = self.lambda_mult * relevancia - (1 - self.lambda_mult) * similitud_max
+            puntuacion[elegidos] = -np.inf
+            siguiente = int(np.argmax(puntuacion))
+            elegidos.append(siguiente)
+            similitud_max = np.maximum(similitud_max, embeddings @ embeddings[siguiente])
+        return elegidos
+
+    @staticmethod
+    def _cluster(embeddings, relevancia, num_grupos, iteraciones=10):
+        """k-means esférico; semillas: el más relevante y luego el más alejado"""
+        semillas = [int(np.argmax(relevancia))]
+        while len(semillas) < num_grupos:
+            distancia = 1 - (embeddings @ embeddings[semillas].T).max(axis=1)
+            distancia[semillas] = -1
+            semillas.append(int(np.argmax(distancia)))
+
+        centros = embeddings[semillas]
+        asignacion = None
+        for _ in range(iteraciones):
+            nueva = np.argmax(embeddings @ centros.T, axis=1)
+            if asignacion is not None and np.array_equal(nueva, asignacion):
+                break
+            asignacion = nueva
+            for g in range(num_grupos):
+                miembros = embeddings[asignacion == g]
+                if len(miembros):
+                    centro = miembros.sum(axis=0)
+                    centros[g] = centro / (np.linalg.norm(centro) or 1)
+        return asignacion
+
+    def retrieve(self, topic, num_questions, num_grupos=1):
+        """Devuelve ``num_grupos`` listas de Document ordenadas por relevancia.
+
+        Si hay menos chunks que grupos, los grupos se repiten de forma
+        cíclica para que cada sub-trabajo tenga contexto.
+        """
+        total = self.vectorstore._collection.count()
+        if not total:
+            return [[] for _ in range(num_grupos)]
+
+        k = min(max(num_questions * self.chunks_por_pregunta, self.k_min), self.k_max, total)
+        fetch_k = min(max(4 * k, 20), total)
+
+        _, docs, embeddings, relevancia = _candidates(self.vectorstore, self.lexical, topic, fetch_k, self.modo)
+        if not docs:
+            return [[] for _ in range(num_grupos)]
+
+        elegidos = self._mmr(relevancia, embeddings, min(k, len(docs)))
+        embeddings = embeddings[elegidos]
+        relevancia = relevancia[elegidos]
+        docs = [docs[i] for i in elegidos]
+
+        num_reales = min(num_grupos, len(docs))
+        asignacion = self._cluster(embeddings, relevancia, num_reales)
+
+        grupos = []
+        for g in range(num_reales):
+            indices = [i for i in np.argsort(-relevancia) if asignacion[i] == g]
+            if indices:
+                grupos.append((relevancia[indices[0]], [docs[i] for i in indices]))
+        grupos = [g for _, g in sorted(grupos, key=lambda x: -x[0])]
+
+        logger.info(
+            f"Recuperación por cobertura: {len(docs)} chunks de {fetch_k} candidatos en {len(grupos)} grupos"
+        )
+        return [grupos[i % len(grupos)] for i in range(num_grupos)]
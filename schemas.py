@@ -0,0 +1,113 @@
+import json
+import logging
+import re
+import unicodedata
+from typing import Annotated, List, Literal, Optional, Union
+import json5
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator, model_validator
+
+logger = logging.getLogger(__name__)
+
+DIFICULTADES = ("básico", "intermedio", "avanzado")
+# Prefijo de opción al principio de una respuesta ("B) París")
+_PREFIJO_OPCION = re.compile(r"^[a-dA-D][).:-]\s*")
+
+
+def loads_lenient(texto):
+    """``json.loads`` y, si falla, JSON5 (comas finales, comentarios, comillas simples)"""
+    try:
+        return json.loads(texto)
+    except json.JSONDecodeError:
+        return json5.loads(texto)
+
+
+class _Pregunta(BaseModel):
+    enunciado: str = Field(min_length=5)
+    respuesta_correcta: str = Field(min_length=1)
+    explicacion: str = ""
+    dificultad: str = "intermedio"
+
+    @field_validator("enunciado", "respuesta_correcta", "explicacion", mode="before")
+    @classmethod
+    def _texto(cls, valor):
+        if isinstance(valor, (int, float, bool)):
+            valor = str(valor)
+        return valor.strip() if isinstance(valor, str) else valor
+
+    @field_validator("dificultad", mode="before")
+    @classmethod
+    def _dificultad(cls, valor):
+        valor = str(valor or "").strip().lower().replace("basico", "básico")
+        return valor if valor in DIFICULTADES else "intermedio"
+
+
+def _sin_prefijo(texto):
+    """Quita el prefijo de opción ("B) ", "c. ", "a- ", "D: ")"""
+    return _PREFIJO_OPCION.sub("", texto, count=1).strip()
+
+
+class PreguntaOpcionMultiple(_Pregunta):
+    tipo: Literal["opcion_multiple"]
+    opciones: List[str] = Field(min_length=4, max_length=4)
+
+    @model_validator(mode="after")
+    def _respuesta_en_opciones(self):
+        opciones = [o.strip() for o in self.opciones]
+        if self.respuesta_correcta in opciones:
+            return self
+        # Respuesta dada como letra ("b", "b)") o con el prefijo de la opción
+        letra = re.fullmatch(r"([a-dA-D])[).]?", self.respuesta_correcta)
+        if letra:
+            self.respuesta_correcta = opciones["abcd".index(letra.group(1).lower())]
+            return self
+        respuesta = _sin_prefijo(self.respuesta_correcta).lower()
+        for opcion in opciones:
+            if _sin_prefijo(opcion).lower() == respuesta:
+                self.respuesta_correcta = opcion
+                return self
+        raise ValueError("La respuesta correcta no coincide con ninguna opción")
+
+
+class PreguntaVerdaderoFalso(_Pregunta):
+    tipo: Literal["verdadero_falso"]
+
+    @field_validator("respuesta_correcta", mode="before")
+    @classmethod
+    def _booleana(cls, valor):
+        texto = str(valor).strip().lower()
+        if texto in ("verdadero", "v", "true", "cierto", "sí", "si"):
+            return "Verdadero"
+        if texto in ("falso", "f", "false", "no"):
+            return "Falso"
+        raise ValueError("La respuesta debe ser Verdadero o Falso")
+
+
+class PreguntaAbierta(_Pregunta):
+    tipo: Literal["pregunta_abierta"]
+
+
+Pregunta = Annotated[
+    Union[PreguntaOpcionMultiple, PreguntaVerdaderoFalso, PreguntaAbierta],
+    Field(discriminator="tipo")
+]
+_validador = TypeAdapter(Pregunta)
+
+
+def _normalize_type(tipo):
+    """"Opción múltiple", "verdadero/falso"... -> nombre canónico del tipo"""
+    tipo = unicodedata.normalize("NFKD", str(tipo or "").strip().lower())
+    tipo = re.sub(r"[\s/-]+", "_", "".join(c for c in tipo if not unicodedata.combining(c)))
+    return "pregunta_abierta" if tipo == "abierta" else tipo
+
+
+def validate_question(pregunta) -> Optional[dict]:
+    """Valida y normaliza una pregunta; devuelve None si no es aprovechable"""
+    if not isinstance(pregunta, dict):
+        return None
+    try:
+        pregunta = {**pregunta, "tipo": _normalize_type(pregunta.get("tipo"))}
+        datos = _validador.validate_python(pregunta).model_dump()
+        return {"tipo": datos.pop("tipo"), **datos}
+    except ValidationError as ve:
+        logger.warning(f"Pregunta inválida descartada: {ve.error_count()} errores")
+        return None
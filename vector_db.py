@@ -1,42 +1,94 @@
 from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings
 import logging
 from config import CONFIG
+from clients import embeddings_namespace, get_embeddings
+from lexical import open_index, remove_index
+from question_bank import forget_chunks, forget_collection
+from metrics import metrics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import asyncio
+import hashlib
+import json
 import os
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Protege el manifiesto de índices frente a escrituras concurrentes
+_manifest_lock = threading.Lock()
+
+
+def _embedding_batch_size():
+    """Chunks por lote de ingesta.
+
+    Con sentence-transformers en varios procesos el lote se agranda para
+    que cada proceso reciba un lote completo; si no, el pool nunca se usa.
+    """
+    if CONFIG["EMBEDDINGS_BACKEND"] == "sentence_transformers" and CONFIG["EMBEDDINGS_LOCAL_PROCESOS"] > 1:
+        return max(
+            CONFIG["EMBEDDING_BATCH_SIZE"],
+            CONFIG["EMBEDDINGS_LOCAL_BATCH"] * CONFIG["EMBEDDINGS_LOCAL_PROCESOS"]
+        )
+    return CONFIG["EMBEDDING_BATCH_SIZE"]
+
 class VectorDatabase:
     def __init__(self):
-        self.embeddings = OllamaEmbeddings(
-            model=CONFIG["MODELO_EMBEDDINGS"]
-            # Eliminado: cache_dir=CONFIG["CACHE_DIR"]
-        )
-        
+        # Los chunks ya vistos se sirven desde la caché en disco sin llamar a Ollama
+        self.embeddings = get_embeddings()
+        # Índices separados por backend de embeddings (dimensiones distintas)
+        espacio = embeddings_namespace()
+        self.collections_dir = os.path.join(CONFIG["DB_DIR"], "colecciones" + espacio)
+        self.manifest_path = os.path.join(CONFIG["DB_DIR"], f"indice{espacio}.json")
+
+    @staticmethod
+    def file_hash(file_path):
+        """Hash sha256 del contenido de un archivo"""
+        h = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for bloque in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloque)
+        return h.hexdigest()
+
+    @staticmethod
+    def collection_name(doc_hash):
+        """Nombre de la colección propia de un documento"""
+        return f"doc_{doc_hash[:16]}"
+
+    @staticmethod
+    def chunk_id(doc_hash, index):
+        """ID estable de un chunk: mismo documento y posición, mismo ID"""
+        return f"{doc_hash}-{index:05d}"
+
     def create_db(self, documents, db_name="default"):
         """Crea una nueva base de datos vectorial"""
         db_path = os.path.join(CONFIG["DB_DIR"], db_name)
-        
+
         try:
-            db = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embeddings,
-                persist_directory=db_path
+            db = Chroma(
+                persist_directory=db_path,
+                embedding_function=self.embeddings
             )
+            self._ingest(db, ((str(uuid.uuid4()), doc) for doc in documents))
+            # Índice léxico (BM25) junto a la colección
+            open_index(db, sync=True)
             logger.info(f"Base de datos vectorial creada en {db_path}")
+            logger.info(f"Caché de embeddings: {self.embeddings.cache.stats()}")
             return db
         except Exception as e:
             logger.error(f"Error creando DB: {str(e)}")
             return None
-    
+
     def load_db(self, db_name="default"):
         """Carga una base de datos existente"""
         db_path = os.path.join(CONFIG["DB_DIR"], db_name)
-        
+
         if not os.path.exists(db_path):
             logger.error(f"Base de datos no encontrada: {db_path}")
             return None
-            
+
         try:
             db = Chroma(
                 persist_directory=db_path,
@@ -46,4 +98,321 @@ class VectorDatabase:
             return db
         except Exception as e:
             logger.error(f"Error cargando DB: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _collection(self, collection):
+        return Chroma(
+            collection_name=collection,
+            persist_directory=self.collections_dir,
+            embedding_function=self.embeddings
+        )
+
+    def is_indexed(self, doc_hash, collection=None):
+        """Indica si el documento ya está indexado en la colección"""
+        collection = collection or self.collection_name(doc_hash)
+        with _manifest_lock:
+            fuentes = self._load_manifest().get(collection, {})
+        return any(info["hash"] == doc_hash for info in fuentes.values())
+
+    def load_document(self, doc_hash, collection=None):
+        """Abre la colección de un documento ya indexado"""
+        collection = collection or self.collection_name(doc_hash)
+        if not self.is_indexed(doc_hash, collection):
+            logger.error(f"Documento no indexado en {collection}: {doc_hash[:12]}")
+            return None
+        return self.load_collection(collection)
+
+    def load_collection(self, collection):
+        """Abre una colección registrada en el manifiesto"""
+        with _manifest_lock:
+            existe = collection in self._load_manifest()
+        if not existe:
+            logger.error(f"Colección no encontrada: {collection}")
+            return None
+
+        try:
+            db = self._collection(collection)
+            logger.info(f"Colección {collection} cargada")
+            return db
+        except Exception as e:
+            logger.error(f"Error cargando DB: {str(e)}")
+            return None
+
+    def sync_lexical_index(self, collection):
+        """Actualiza el índice BM25 de una colección contra Chroma"""
+        open_index(self._collection(collection), sync=True)
+
+    def index_document(self, chunks, doc_hash, source, collection=None, sync_lexical=True):
+        """Indexa un documento de forma incremental.
+
+        ``chunks`` puede ser una lista o un generador (``iter_chunks``). Sin colección explícita cada documento va a su propia colección
+        (``doc_<hash>``). Los chunks se insertan con IDs estables, los ya
+        presentes no se vuelven a embeber y, si el mismo origen se indexó
+        antes con otro contenido, sus chunks antiguos se eliminan.
+
+        Cada actualización del índice BM25 reescribe el archivo completo de
+        la colección: al indexar varios documentos seguidos conviene pasar
+        ``sync_lexical=False`` y llamar una vez a ``sync_lexical_index``.
+        """
+        collection = collection or self.collection_name(doc_hash)
+
+        try:
+            if self.is_indexed(doc_hash, collection):
+                logger.info(f"Documento ya indexado en {collection}, se omite")
+                self._register(collection, source, doc_hash, None)
+                db = self._collection(collection)
+                if sync_lexical:
+                    open_index(db, sync=True)
+                return db
+
+            db = self._collection(collection)
+            ids, nuevos, existentes = self._ingest(db, self._with_ids(chunks, doc_hash))
+            if not ids:
+                logger.error("El documento no produjo ningún chunk")
+                return None
+
+            self._finish_index(db, collection, source, doc_hash, ids, nuevos, existentes, sync_lexical)
+            return db
+        except Exception as e:
+            logger.error(f"Error indexando documento: {str(e)}")
+            return None
+
+    async def aindex_document(self, chunks, doc_hash, source, collection=None, sync_lexical=True):
+        """Versión asíncrona de ``index_document``.
+
+        Los lotes se embeben con el cliente asíncrono de Ollama; las
+        operaciones sobre Chroma y el parseo del generador de chunks se
+        ejecutan en hilos para no bloquear el bucle de eventos.
+        """
+        collection = collection or self.collection_name(doc_hash)
+
+        try:
+            if await asyncio.to_thread(self.is_indexed, doc_hash, collection):
+                logger.info(f"Documento ya indexado en {collection}, se omite")
+                await asyncio.to_thread(self._register, collection, source, doc_hash, None)
+                db = await asyncio.to_thread(self._collection, collection)
+                if sync_lexical:
+                    await asyncio.to_thread(open_index, db, True)
+                return db
+
+            db = await asyncio.to_thread(self._collection, collection)
+            ids, nuevos, existentes = await self._aingest(db, self._with_ids(chunks, doc_hash))
+            if not ids:
+                logger.error("El documento no produjo ningún chunk")
+                return None
+
+            await asyncio.to_thread(
+                self._finish_index, db, collection, source, doc_hash, ids, nuevos, existentes, sync_lexical
+            )
+            return db
+        except Exception as e:
+            logger.error(f"Error indexando documento: {str(e)}")
+            return None
+
+    def _finish_index(self, db, collection, source, doc_hash, ids, nuevos, existentes, sync_lexical=True):
+        """Elimina chunks sobrantes, registra el documento y actualiza el índice BM25"""
+        # Chunks sobrantes del mismo documento (p. ej. cambió el troceado)
+        sobrantes = set(db.get(where={"doc_hash": doc_hash}, include=[])["ids"]) - set(ids)
+        if sobrantes:
+            db.delete(ids=list(sobrantes))
+            forget_chunks(list(sobrantes))
+
+        self._register(collection, source, doc_hash, len(ids))
+        if sync_lexical:
+            open_index(db, sync=True)
+        metrics.contar("chunks_indexados_total", nuevos, coleccion=collection)
+        metrics.contar("chunks_reutilizados_total", existentes, coleccion=collection)
+        logger.info(
+            f"Colección {collection}: {nuevos} chunks nuevos, "
+            f"{existentes} reutilizados, {len(sobrantes)} eliminados"
+        )
+        logger.info(f"Caché de embeddings: {self.embeddings.cache.stats()}")
+
+    def _with_ids(self, chunks, doc_hash):
+        for i, chunk in enumerate(chunks):
+            chunk.metadata["doc_hash"] = doc_hash
+            yield self.chunk_id(doc_hash, i), chunk
+
+    def _ingest(self, db, pares):
+        """Embebe y escribe chunks en lotes concurrentes.
+
+        ``pares`` es un iterable de (id, chunk) que se consume de forma
+        perezosa: cada lote se filtra contra los IDs ya presentes, se embebe
+        en el pool de hilos y se escribe en bloque en Chroma en cuanto
+        termina, con un máximo de lotes en vuelo.
+        """
+        batch_size = _embedding_batch_size()
+        max_en_vuelo = CONFIG["EMBEDDING_MAX_EN_VUELO"]
+        ids, nuevos, existentes = [], 0, 0
+        pendientes = {}
+
+        def escribir(hechos):
+            nonlocal nuevos
+            for futuro in hechos:
+                lote = pendientes.pop(futuro)
+                self._upsert(db, lote, futuro.result())
+                nuevos += len(lote)
+
+        pares = iter(pares)
+        with ThreadPoolExecutor(max_workers=CONFIG["EMBEDDING_WORKERS"]) as pool:
+            while True:
+                lote = list(islice(pares, batch_size))
+                if not lote:
+                    break
+
+                ids.extend(i for i, _ in lote)
+                presentes = self._present_ids(db, lote)
+                existentes += len(presentes)
+                lote = [(i, c) for i, c in lote if i not in presentes]
+                if not lote:
+                    continue
+
+                futuro = pool.submit(self._embed_with_retry, [c.page_content for _, c in lote])
+                pendientes[futuro] = lote
+
+                if len(pendientes) >= max_en_vuelo:
+                    hechos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                    escribir(hechos)
+
+            escribir(list(pendientes))
+
+        return ids, nuevos, existentes
+
+    async def _aingest(self, db, pares):
+        """Versión asíncrona de ``_ingest`` con el mismo límite de lotes en vuelo"""
+        batch_size = _embedding_batch_size()
+        en_vuelo = asyncio.Semaphore(CONFIG["EMBEDDING_MAX_EN_VUELO"])
+        ids, existentes, tareas = [], 0, []
+
+        async def procesar(lote):
+            try:
+                vectores = await self._aembed_with_retry([c.page_content for _, c in lote])
+                await asyncio.to_thread(self._upsert, db, lote, vectores)
+                return len(lote)
+            finally:
+                en_vuelo.release()
+
+        pares = iter(pares)
+        try:
+            while True:
+                lote = await asyncio.to_thread(lambda: list(islice(pares, batch_size)))
+                if not lote:
+                    break
+
+                ids.extend(i for i, _ in lote)
+                presentes = await asyncio.to_thread(self._present_ids, db, lote)
+                existentes += len(presentes)
+                lote = [(i, c) for i, c in lote if i not in presentes]
+                if not lote:
+                    continue
+
+                await en_vuelo.acquire()
+                tareas.append(asyncio.create_task(procesar(lote)))
+            nuevos = sum(await asyncio.gather(*tareas))
+        except BaseException:
+            for tarea in tareas:
+                tarea.cancel()
+            raise
+
+        return ids, nuevos, existentes
+
+    @staticmethod
+    def _present_ids(db, lote):
+        return set(db.get(ids=[i for i, _ in lote], include=[])["ids"])
+
+    @staticmethod
+    def _upsert(db, lote, vectores):
+        db._collection.upsert(
+            ids=[i for i, _ in lote],
+            embeddings=vectores,
+            metadatas=[c.metadata for _, c in lote],
+            documents=[c.page_content for _, c in lote]
+        )
+
+    def _embed_with_retry(self, texts):
+        """Embebe un lote reintentando con espera exponencial"""
+        reintentos = CONFIG["EMBEDDING_REINTENTOS"]
+        for intento in range(reintentos + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if intento == reintentos:
+                    raise
+                espera = 2 ** intento
+                logger.warning(f"Error embebiendo lote ({e}), reintento en {espera}s")
+                time.sleep(espera)
+
+    async def _aembed_with_retry(self, texts):
+        """Versión asíncrona de ``_embed_with_retry``"""
+        reintentos = CONFIG["EMBEDDING_REINTENTOS"]
+        for intento in range(reintentos + 1):
+            try:
+                return await self.embeddings.aembed_documents(texts)
+            except Exception as e:
+                if intento == reintentos:
+                    raise
+                espera = 2 ** intento
+                logger.warning(f"Error embebiendo lote ({e}), reintento en {espera}s")
+                await asyncio.sleep(espera)
+
+    def _register(self, collection, source, doc_hash, num_chunks):
+        """Anota el documento en el manifiesto y purga versiones antiguas del origen"""
+        hashes_obsoletos = []
+        colecciones_obsoletas = []
+
+        with _manifest_lock:
+            manifest = self._load_manifest()
+            fuentes = manifest.setdefault(collection, {})
+            if num_chunks is None:
+                num_chunks = next(
+                    (info["chunks"] for info in fuentes.values() if info["hash"] == doc_hash), 0
+                )
+
+            # Contenido anterior del mismo origen dentro de esta colección
+            previo = fuentes.get(source)
+            fuentes[source] = {"hash": doc_hash, "chunks": num_chunks}
+            if previo and previo["hash"] != doc_hash:
+                if not any(info["hash"] == previo["hash"] for info in fuentes.values()):
+                    hashes_obsoletos.append(previo["hash"])
+
+            # Versiones anteriores del mismo origen en su propia colección
+            for nombre, otras in list(manifest.items()):
+                previo = otras.get(source)
+                if nombre == collection or not previo or previo["hash"] == doc_hash:
+                    continue
+                if nombre == self.collection_name(previo["hash"]):
+                    del otras[source]
+                    if not otras:
+                        del manifest[nombre]
+                        colecciones_obsoletas.append(nombre)
+
+            self._save_manifest(manifest)
+
+        if hashes_obsoletos:
+            db = self._collection(collection)
+            for old_hash in hashes_obsoletos:
+                obsoletos = db.get(where={"doc_hash": old_hash}, include=[])["ids"]
+                if obsoletos:
+                    db.delete(ids=obsoletos)
+                    forget_chunks(obsoletos)
+                    logger.info(f"{len(obsoletos)} chunks obsoletos eliminados de {collection}")
+
+        for nombre in colecciones_obsoletas:
+            obsoleta = self._collection(nombre)
+            remove_index(obsoleta)
+            forget_collection(obsoleta)
+            obsoleta.delete_collection()
+            logger.info(f"Colección obsoleta eliminada: {nombre}")